@@ -14,9 +14,11 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+from pathlib import Path
 import typing
 
 import ksysguard_mdraid_monitor.constants
+from ksysguard_mdraid_monitor.group import GroupDefinition, group_definition
 
 
 class NonNegativeInt(int):
@@ -27,6 +29,26 @@ class NonNegativeInt(int):
         return new
 
 
+class PositiveInt(int):
+    def __new__(cls, *args, **kwargs):
+        new: PositiveInt = super(PositiveInt, cls).__new__(cls, *args, **kwargs)
+        if new <= 0:
+            raise ValueError(f"Invalid number. Expected a positive integer. Got {new}.")
+        return new
+
+
+class PositiveFloat(float):
+    def __new__(cls, *args, **kwargs):
+        new: PositiveFloat = super(PositiveFloat, cls).__new__(cls, *args, **kwargs)
+        if not new > 0:
+            raise ValueError(f"Invalid number. Expected a positive number. Got {new}.")
+        return new
+
+
+DEFAULT_MIN_INTERVAL_MS = 10
+DEFAULT_MAX_INTERVAL_MS = 1000
+
+
 class Namespace(typing.NamedTuple):
     """
     Mocks the Namespace object returned by the argument parser as the result of parsing the arguments.
@@ -34,16 +56,116 @@ class Namespace(typing.NamedTuple):
     This is never instantiated in the code, except for maybe in unit tests.
     """
     min_interval_ms: NonNegativeInt
+    max_interval_ms: NonNegativeInt
+    lazy_parsing: bool
+    record: typing.Optional[Path]
+    replay: typing.Optional[Path]
+    replay_speed: PositiveFloat
+    once: bool
+    format: str
+    trace_memory: bool
+    metrics_log: typing.Optional[Path]
+    metrics_log_max_size: NonNegativeInt
+    metrics_log_keep: NonNegativeInt
+    metrics_log_interval: PositiveFloat
+    sysfs_root: Path
+    slow_member_factor: PositiveFloat
+    groups: typing.List[GroupDefinition]
+    md_name_directory: Path
 
 
 def generate_argument_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "-i", "--min-interval", dest="min_interval_ms", metavar="MILLISECONDS",
-        type=NonNegativeInt, default=NonNegativeInt(10),
+        type=NonNegativeInt, default=None,
         help="Minimal delay between querying /proc/mdstat in milliseconds. This delay avoids unnecessary re-parsing "
-             "of /proc/mdstat if multiple values are requested by KSysGuard in quick succession. Defaults to "
-             "%(default)i ms. Requires a non-negative integer."
+             "of /proc/mdstat if multiple values are requested by KSysGuard in quick succession. This delay is used "
+             f"while any array is degraded or performs maintenance. Defaults to {DEFAULT_MIN_INTERVAL_MS} ms or the "
+             "value of --max-interval, whichever is smaller. Requires a non-negative integer."
+    )
+    parser.add_argument(
+        "-I", "--max-interval", dest="max_interval_ms", metavar="MILLISECONDS",
+        type=NonNegativeInt, default=None,
+        help="Maximal delay between querying /proc/mdstat in milliseconds. While all arrays are clean and idle, the "
+             "delay is doubled each time /proc/mdstat did not change, until this value is reached. Set it to the "
+             f"value of --min-interval to disable the adaptive delay. Defaults to {DEFAULT_MAX_INTERVAL_MS} ms or the "
+             "value of --min-interval, whichever is greater. Requires a non-negative integer that is not less than "
+             "--min-interval."
+    )
+    parser.add_argument(
+        "--lazy-parsing", action="store_true",
+        help="Only split /proc/mdstat into per-array blocks when reading it. Each line of a block is parsed when "
+             "a sensor requires any value of it for the first time. This reduces the parsing work, "
+             "if only few sensors are queried."
+    )
+    parser.add_argument(
+        "--record", metavar="FILE", type=Path,
+        help="Record all read /proc/mdstat snapshots to FILE. Only snapshots that differ from the previous one are "
+             "recorded. If FILE ends with '.gz', the recording is gzip compressed. An existing FILE is appended to."
+    )
+    parser.add_argument(
+        "--replay", metavar="FILE", type=Path,
+        help="Do not read /proc/mdstat. Instead, replay the snapshots from a recording created with --record."
+    )
+    parser.add_argument(
+        "--replay-speed", metavar="FACTOR", type=PositiveFloat, default=PositiveFloat(1),
+        help="Replay the recording given by --replay FACTOR times faster than it was recorded. "
+             "Defaults to %(default)g (real time). Requires a positive number."
+    )
+    parser.add_argument(
+        "--sysfs-root", metavar="DIRECTORY", type=Path, default=Path("/sys"),
+        help="Mount point of the sysfs file system, used to read I/O statistics of block devices. "
+             "Defaults to %(default)s."
+    )
+    parser.add_argument(
+        "--slow-member-factor", metavar="FACTOR", type=PositiveFloat, default=PositiveFloat(5),
+        help="Flag a RAID component device as slow, if its average I/O wait time is FACTOR times the mean wait time of "
+             "the other components in the same array. Defaults to %(default)g."
+    )
+    parser.add_argument(
+        "--group", dest="groups", metavar="NAME=KIND:SPEC", type=group_definition, action="append", default=[],
+        help="Define an array group and provide the sensors SoftRaid/Group/NAME/... for it. KIND selects how arrays "
+             "are matched: \"level:raid6\" matches by raid level, \"pattern:md[0-3]\" matches the md device name "
+             "and \"name:data*\" matches the array name, given by the symlinks in --md-name-directory. Patterns use "
+             "shell wildcards. Can be given multiple times. Repeating a NAME adds the matched arrays to the same group."
+    )
+    parser.add_argument(
+        "--md-name-directory", metavar="DIRECTORY", type=Path, default=Path("/dev/md"),
+        help="Directory containing a symlink to the md device node for each named array. Used by \"name:\" groups. "
+             "Defaults to %(default)s."
+    )
+    parser.add_argument(
+        "--metrics-log", metavar="FILE", type=Path,
+        help="Append all aggregate values and all per-array state changes to the binary log FILE, each time "
+             "/proc/mdstat changes. Logged values can be retrieved with the query command, also across restarts."
+    )
+    parser.add_argument(
+        "--metrics-log-max-size", metavar="BYTES", type=NonNegativeInt, default=NonNegativeInt(64 * 1024 * 1024),
+        help="Rotate the metrics log, when it reaches this size. Defaults to %(default)i bytes."
+    )
+    parser.add_argument(
+        "--metrics-log-keep", metavar="COUNT", type=NonNegativeInt, default=NonNegativeInt(4),
+        help="Number of rotated metrics log files to keep. Defaults to %(default)i."
+    )
+    parser.add_argument(
+        "--metrics-log-interval", metavar="SECONDS", type=PositiveFloat, default=PositiveFloat(60),
+        help="Interval for logging the sensors that do not depend on /proc/mdstat, like the I/O sensors. Sensors "
+             "depending on /proc/mdstat are logged each time it changes. Defaults to %(default)g seconds."
+    )
+    parser.add_argument(
+        "--once", action="store_true",
+        help="Do not start the interactive daemon. Instead, print all aggregate and per-array values once "
+             "in the format given by --format and exit."
+    )
+    parser.add_argument(
+        "--format", choices=("json", "csv"), default="json",
+        help="Output format used by --once. Defaults to %(default)s."
+    )
+    parser.add_argument(
+        "--trace-memory", action="store_true",
+        help="Trace memory allocations, so that the debug-memory command can report the heaviest allocation sites. "
+             "This slows down the program and increases its memory usage."
     )
     parser.add_argument(
         '-V', '--version',
@@ -53,7 +175,19 @@ def generate_argument_parser() -> argparse.ArgumentParser:
     return parser
 
 
-def parse_arguments() -> Namespace:
+def parse_arguments(argv: typing.Optional[typing.List[str]] = None) -> Namespace:
+    """Parses the given arguments, or sys.argv if None, and resolves the defaults that depend on other arguments."""
     parser = generate_argument_parser()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    # Only reject the intervals, if both are given explicitly. This keeps command lines valid that only set
+    # --min-interval, which predates --max-interval.
+    if args.min_interval_ms is None:
+        default_min_interval_ms = DEFAULT_MIN_INTERVAL_MS if args.max_interval_ms is None else min(
+            DEFAULT_MIN_INTERVAL_MS, args.max_interval_ms)
+        args.min_interval_ms = NonNegativeInt(default_min_interval_ms)
+    if args.max_interval_ms is None:
+        args.max_interval_ms = NonNegativeInt(max(DEFAULT_MAX_INTERVAL_MS, args.min_interval_ms))
+    elif args.max_interval_ms < args.min_interval_ms:
+        parser.error(
+            f"--max-interval ({args.max_interval_ms}) must not be less than --min-interval ({args.min_interval_ms})")
     return args
@@ -0,0 +1,107 @@
+# Copyright (C) 2020 Thomas Hess <thomas.hess@udo.edu>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Computes I/O rates of block devices from the counters in their sysfs "stat" file.
+The file format is described in https://www.kernel.org/doc/Documentation/block/stat.txt
+"""
+
+from array import array
+from pathlib import Path
+import typing
+
+# Indices of the used counters in the stat file
+READ_IOS = 0
+READ_SECTORS = 2
+READ_TICKS = 3
+WRITE_IOS = 4
+WRITE_SECTORS = 6
+WRITE_TICKS = 7
+IN_FLIGHT = 8
+IO_TICKS = 9
+FIELD_COUNT = 10
+SECTOR_SIZE = 512
+# Counters have a resolution of one I/O or one millisecond. Rates computed over shorter intervals are mostly noise.
+MIN_SAMPLE_INTERVAL_NS = 1_000_000_000
+
+
+def read_block_stat(path: Path) -> typing.List[int]:
+    """Returns the first FIELD_COUNT counters of the given stat file. Returns zeros, if the file can not be read."""
+    try:
+        fields = path.read_text(encoding="ascii").split()[:FIELD_COUNT]
+    except OSError:
+        return [0] * FIELD_COUNT
+    return [int(field) for field in fields] + [0] * (FIELD_COUNT - len(fields))
+
+
+class BlockStatCollector:
+    """
+    Samples the stat files of a set of block devices and computes rates from the counter deltas between two samples.
+    Counters and rates are kept in flat arrays, indexed by the position of the device in device_names.
+    """
+    def __init__(self, stat_path: typing.Callable[[str], Path]):
+        self.stat_path = stat_path
+        self.device_names: typing.List[str] = []
+        self._counters = array("Q")  # FIELD_COUNT counters per device
+        self._sample_ns = 0
+        self.read_iops = array("d")
+        self.write_iops = array("d")
+        self.read_bytes_per_sec = array("d")
+        self.write_bytes_per_sec = array("d")
+        self.in_flight = array("Q")
+        self.average_wait_ms = array("d")  # Average time an I/O request took to complete
+        self.utilization = array("d")  # Fraction of the time with I/O requests in flight
+
+    def update(self, device_names: typing.List[str], now_ns: int):
+        """Samples all given devices. Does nothing, if the device set is unchanged and the last sample is too recent."""
+        devices_changed = device_names != self.device_names
+        if not devices_changed and now_ns - self._sample_ns < MIN_SAMPLE_INTERVAL_NS:
+            return
+        counters = array("Q")
+        for device_name in device_names:
+            counters.extend(read_block_stat(self.stat_path(device_name)))
+        device_count = len(device_names)
+        if devices_changed:
+            # Without a previous sample, no rates can be computed yet
+            for rates in (self.read_iops, self.write_iops, self.read_bytes_per_sec, self.write_bytes_per_sec,
+                          self.average_wait_ms, self.utilization):
+                rates[:] = array("d", [0.0] * device_count)
+            self.device_names = list(device_names)
+        else:
+            self._compute_rates(counters, (now_ns - self._sample_ns) / 1_000_000_000)
+        self.in_flight = array("Q", counters[IN_FLIGHT::FIELD_COUNT])
+        self._counters = counters
+        self._sample_ns = now_ns
+
+    def _compute_rates(self, counters: array, elapsed_s: float):
+        previous = self._counters
+
+        def delta(field: int) -> typing.List[int]:
+            # Counters are reset, if a device is re-created. Treat this as no activity.
+            return [
+                max(0, current - old)
+                for current, old in zip(counters[field::FIELD_COUNT], previous[field::FIELD_COUNT])
+            ]
+
+        read_ios, write_ios = delta(READ_IOS), delta(WRITE_IOS)
+        ticks = [read + write for read, write in zip(delta(READ_TICKS), delta(WRITE_TICKS))]
+        self.read_iops = array("d", (ios / elapsed_s for ios in read_ios))
+        self.write_iops = array("d", (ios / elapsed_s for ios in write_ios))
+        self.read_bytes_per_sec = array("d", (sectors * SECTOR_SIZE / elapsed_s for sectors in delta(READ_SECTORS)))
+        self.write_bytes_per_sec = array("d", (sectors * SECTOR_SIZE / elapsed_s for sectors in delta(WRITE_SECTORS)))
+        self.average_wait_ms = array("d", (
+            tick / (read + write) if read + write else 0.0 for tick, read, write in zip(ticks, read_ios, write_ios)
+        ))
+        self.utilization = array("d", (min(1.0, io_ticks / 1000 / elapsed_s) for io_ticks in delta(IO_TICKS)))
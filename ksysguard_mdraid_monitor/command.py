@@ -32,6 +32,10 @@ class AbstractMonitor:
     To implement a "listview" type (a table), overwrite self.command_info() to provide the required table header
     and units.
     """
+    # True, if the value only depends on /proc/mdstat and therefore only changes when /proc/mdstat changes.
+    # Monitors reading other sources, like sysfs, set this to False. Used by the metrics log.
+    derived_from_mdstat = True
+
     def __init__(self, parent):
         self.parent: KSysGuardDaemon = parent
 
@@ -478,3 +482,632 @@ class TotalComponentCount(AbstractMonitor):
     @property
     def unit(self) -> typing.Optional[str]:
         return None
+
+
+class FailedComponentCount(AbstractMonitor):
+    """
+    Reports the total number of faulty RAID components, marked with (F) in /proc/mdstat.
+    Upper bound is the total component count.
+    """
+    @property
+    def command(self) -> str:
+        return "SoftRaid/FailedComponents"
+
+    @property
+    def command_value(self):
+        return self.parent.raid_status.failed_component_count
+
+    @property
+    def output_type(self) -> str:
+        return "integer"
+
+    @property
+    def description(self) -> str:
+        return "Failed component count"
+
+    @property
+    def min(self):
+        return 0
+
+    @property
+    def max(self):
+        return self.parent.raid_status.total_component_count
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return None
+
+
+class SpareComponentCount(AbstractMonitor):
+    """
+    Reports the total number of working hot spare components, marked with (S) in /proc/mdstat.
+    Upper bound is the total component count.
+    """
+    @property
+    def command(self) -> str:
+        return "SoftRaid/SpareComponents"
+
+    @property
+    def command_value(self):
+        return self.parent.raid_status.spare_component_count
+
+    @property
+    def output_type(self) -> str:
+        return "integer"
+
+    @property
+    def description(self) -> str:
+        return "Spare component count"
+
+    @property
+    def min(self):
+        return 0
+
+    @property
+    def max(self):
+        return self.parent.raid_status.total_component_count
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return None
+
+
+class WriteMostlyComponentCount(AbstractMonitor):
+    """
+    Reports the total number of write-mostly components, marked with (W) in /proc/mdstat.
+    Upper bound is the total component count.
+    """
+    @property
+    def command(self) -> str:
+        return "SoftRaid/WriteMostlyComponents"
+
+    @property
+    def command_value(self):
+        return self.parent.raid_status.write_mostly_component_count
+
+    @property
+    def output_type(self) -> str:
+        return "integer"
+
+    @property
+    def description(self) -> str:
+        return "Write-mostly component count"
+
+    @property
+    def min(self):
+        return 0
+
+    @property
+    def max(self):
+        return self.parent.raid_status.total_component_count
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return None
+
+
+class WithoutSpareDeviceCount(AbstractMonitor):
+    """
+    Reports the total number of RAID devices with redundancy (raid 1, 4, 5, 6 and 10) that have no working hot spare.
+    Upper bound is the total device count.
+    """
+    @property
+    def command(self) -> str:
+        return "SoftRaid/DevicesWithoutSpare"
+
+    @property
+    def command_value(self):
+        return self.parent.raid_status.without_spare_device_count
+
+    @property
+    def output_type(self) -> str:
+        return "integer"
+
+    @property
+    def description(self) -> str:
+        return "Devices without hot spare"
+
+    @property
+    def min(self):
+        return 0
+
+    @property
+    def max(self):
+        return self.parent.raid_status.total_device_count
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return None
+
+
+class ReadIops(AbstractMonitor):
+    """Reports the total number of completed read requests per second across all RAID devices."""
+    derived_from_mdstat = False
+
+    @property
+    def command(self) -> str:
+        return "SoftRaid/IO/ReadIOPS"
+
+    @property
+    def command_value(self):
+        return round(sum(self.parent.array_io.read_iops), 1)
+
+    @property
+    def output_type(self) -> str:
+        return "float"
+
+    @property
+    def description(self) -> str:
+        return "Read operations"
+
+    @property
+    def min(self):
+        return 0
+
+    @property
+    def max(self):
+        return 0
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return "1/s"
+
+
+class WriteIops(AbstractMonitor):
+    """Reports the total number of completed write requests per second across all RAID devices."""
+    derived_from_mdstat = False
+
+    @property
+    def command(self) -> str:
+        return "SoftRaid/IO/WriteIOPS"
+
+    @property
+    def command_value(self):
+        return round(sum(self.parent.array_io.write_iops), 1)
+
+    @property
+    def output_type(self) -> str:
+        return "float"
+
+    @property
+    def description(self) -> str:
+        return "Write operations"
+
+    @property
+    def min(self):
+        return 0
+
+    @property
+    def max(self):
+        return 0
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return "1/s"
+
+
+class ReadRate(AbstractMonitor):
+    """Reports the total read throughput across all RAID devices."""
+    derived_from_mdstat = False
+
+    @property
+    def command(self) -> str:
+        return "SoftRaid/IO/ReadRate"
+
+    @property
+    def command_value(self):
+        return round(sum(self.parent.array_io.read_bytes_per_sec) / 1024, 1)
+
+    @property
+    def output_type(self) -> str:
+        return "float"
+
+    @property
+    def description(self) -> str:
+        return "Read rate"
+
+    @property
+    def min(self):
+        return 0
+
+    @property
+    def max(self):
+        return 0
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return "KB/s"
+
+
+class WriteRate(AbstractMonitor):
+    """Reports the total write throughput across all RAID devices."""
+    derived_from_mdstat = False
+
+    @property
+    def command(self) -> str:
+        return "SoftRaid/IO/WriteRate"
+
+    @property
+    def command_value(self):
+        return round(sum(self.parent.array_io.write_bytes_per_sec) / 1024, 1)
+
+    @property
+    def output_type(self) -> str:
+        return "float"
+
+    @property
+    def description(self) -> str:
+        return "Write rate"
+
+    @property
+    def min(self):
+        return 0
+
+    @property
+    def max(self):
+        return 0
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return "KB/s"
+
+
+class InFlightRequests(AbstractMonitor):
+    """Reports the total number of I/O requests currently in flight across all RAID devices."""
+    derived_from_mdstat = False
+
+    @property
+    def command(self) -> str:
+        return "SoftRaid/IO/InFlight"
+
+    @property
+    def command_value(self):
+        return sum(self.parent.array_io.in_flight)
+
+    @property
+    def output_type(self) -> str:
+        return "integer"
+
+    @property
+    def description(self) -> str:
+        return "I/O requests in flight"
+
+    @property
+    def min(self):
+        return 0
+
+    @property
+    def max(self):
+        return 0
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return None
+
+
+class ArrayIoTable(AbstractMonitor):
+    """Reports the I/O statistics of each RAID device as a table."""
+    derived_from_mdstat = False
+
+    def command_info(self):
+        print("Device\tRead IOPS\tWrite IOPS\tRead KB/s\tWrite KB/s\tIn flight\ns\tf\tf\tf\tf\td")
+
+    @property
+    def command(self) -> str:
+        return "SoftRaid/IO/Devices"
+
+    @property
+    def command_value(self):
+        io = self.parent.array_io
+        return "\n".join(
+            f"{io.device_names[index]}\t{io.read_iops[index]:.1f}\t{io.write_iops[index]:.1f}\t"
+            f"{io.read_bytes_per_sec[index] / 1024:.1f}\t{io.write_bytes_per_sec[index] / 1024:.1f}\t"
+            f"{io.in_flight[index]}"
+            for index in range(len(io.device_names))
+        )
+
+    @property
+    def output_type(self) -> str:
+        return "listview"
+
+    @property
+    def description(self) -> str:
+        return "RAID device I/O"
+
+    @property
+    def min(self):
+        return 0
+
+    @property
+    def max(self):
+        return 0
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return None
+
+
+class SlowMemberCount(AbstractMonitor):
+    """
+    Reports the total number of RAID components with an average I/O wait time far above the one of the other
+    components in the same array. Such components are likely to fail soon. Upper bound is the total component count.
+    """
+    derived_from_mdstat = False
+
+    @property
+    def command(self) -> str:
+        return "SoftRaid/Members/SlowMembers"
+
+    @property
+    def command_value(self):
+        return self.parent.member_health.slow_member_count
+
+    @property
+    def output_type(self) -> str:
+        return "integer"
+
+    @property
+    def description(self) -> str:
+        return "Slow component count"
+
+    @property
+    def min(self):
+        return 0
+
+    @property
+    def max(self):
+        return self.parent.raid_status.total_component_count
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return None
+
+
+class WithSlowMembersDeviceCount(AbstractMonitor):
+    """Reports the total number of RAID devices that have slow components. Upper bound is the total device count."""
+    derived_from_mdstat = False
+
+    @property
+    def command(self) -> str:
+        return "SoftRaid/Members/DevicesWithSlowMembers"
+
+    @property
+    def command_value(self):
+        return self.parent.member_health.device_with_slow_members_count
+
+    @property
+    def output_type(self) -> str:
+        return "integer"
+
+    @property
+    def description(self) -> str:
+        return "Devices with slow components"
+
+    @property
+    def min(self):
+        return 0
+
+    @property
+    def max(self):
+        return self.parent.raid_status.total_device_count
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return None
+
+
+class MemberIoTable(AbstractMonitor):
+    """Reports the I/O statistics of each RAID component as a table, including whether it is flagged as slow."""
+    derived_from_mdstat = False
+
+    def command_info(self):
+        print(
+            "Component\tDevice\tRead IOPS\tWrite IOPS\tRead KB/s\tWrite KB/s\tWait ms\tUtilization %\tSlow\n"
+            "s\ts\tf\tf\tf\tf\tf\tf\td"
+        )
+
+    @property
+    def command(self) -> str:
+        return "SoftRaid/Members/Components"
+
+    @property
+    def command_value(self):
+        health = self.parent.member_health
+        io = health.io
+        return "\n".join(
+            f"{io.device_names[index]}\t{health.member_arrays[index]}\t"
+            f"{io.read_iops[index]:.1f}\t{io.write_iops[index]:.1f}\t"
+            f"{io.read_bytes_per_sec[index] / 1024:.1f}\t{io.write_bytes_per_sec[index] / 1024:.1f}\t"
+            f"{io.average_wait_ms[index]:.1f}\t{io.utilization[index] * 100:.1f}\t{health.slow[index]}"
+            for index in range(len(io.device_names))
+        )
+
+    @property
+    def output_type(self) -> str:
+        return "listview"
+
+    @property
+    def description(self) -> str:
+        return "RAID component I/O"
+
+    @property
+    def min(self):
+        return 0
+
+    @property
+    def max(self):
+        return 0
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return None
+
+
+class TotalCapacity(AbstractMonitor):
+    """
+    Reports the total capacity of all RAID devices in bytes. Upper bound is the total capacity itself.
+    """
+    @property
+    def command(self) -> str:
+        return "SoftRaid/Capacity/Total"
+
+    @property
+    def command_value(self):
+        return self.parent.raid_status.total_capacity_bytes
+
+    @property
+    def output_type(self) -> str:
+        return "integer"
+
+    @property
+    def description(self) -> str:
+        return "Total RAID capacity"
+
+    @property
+    def min(self):
+        return 0
+
+    @property
+    def max(self):
+        return self.parent.raid_status.total_capacity_bytes
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return "B"
+
+
+class DegradedCapacity(AbstractMonitor):
+    """
+    Reports the total capacity of degraded RAID devices in bytes. Upper bound is the total capacity.
+    """
+    @property
+    def command(self) -> str:
+        return "SoftRaid/Capacity/Degraded"
+
+    @property
+    def command_value(self):
+        return self.parent.raid_status.degraded_capacity_bytes
+
+    @property
+    def output_type(self) -> str:
+        return "integer"
+
+    @property
+    def description(self) -> str:
+        return "Capacity on degraded devices"
+
+    @property
+    def min(self):
+        return 0
+
+    @property
+    def max(self):
+        return self.parent.raid_status.total_capacity_bytes
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return "B"
+
+
+class RebuildingCapacity(AbstractMonitor):
+    """
+    Reports the total capacity of RAID devices that perform a resync or recovery in bytes.
+    Upper bound is the total capacity.
+    """
+    @property
+    def command(self) -> str:
+        return "SoftRaid/Capacity/Rebuilding"
+
+    @property
+    def command_value(self):
+        return self.parent.raid_status.rebuilding_capacity_bytes
+
+    @property
+    def output_type(self) -> str:
+        return "integer"
+
+    @property
+    def description(self) -> str:
+        return "Capacity under resync/recovery"
+
+    @property
+    def min(self):
+        return 0
+
+    @property
+    def max(self):
+        return self.parent.raid_status.total_capacity_bytes
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return "B"
+
+
+class WithoutRedundancyCapacity(AbstractMonitor):
+    """
+    Reports the total capacity of RAID devices without redundancy left in bytes. These lost as many components as
+    their RAID level tolerates, or never had redundancy, like raid0. Upper bound is the total capacity.
+    """
+    @property
+    def command(self) -> str:
+        return "SoftRaid/Capacity/WithoutRedundancy"
+
+    @property
+    def command_value(self):
+        return self.parent.raid_status.without_redundancy_capacity_bytes
+
+    @property
+    def output_type(self) -> str:
+        return "integer"
+
+    @property
+    def description(self) -> str:
+        return "Capacity without redundancy"
+
+    @property
+    def min(self):
+        return 0
+
+    @property
+    def max(self):
+        return self.parent.raid_status.total_capacity_bytes
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return "B"
+
+
+class RefreshInterval(AbstractMonitor):
+    """
+    Reports the current delay between two reads of /proc/mdstat. The delay adapts to the RAID status and is bound by
+    the --min-interval and --max-interval command line arguments.
+    """
+    derived_from_mdstat = False
+
+    @property
+    def command(self) -> str:
+        return "SoftRaid/RefreshInterval"
+
+    @property
+    def command_value(self):
+        return self.parent.refresh_scheduler.interval_ms
+
+    @property
+    def output_type(self) -> str:
+        return "integer"
+
+    @property
+    def description(self) -> str:
+        return "Refresh interval"
+
+    @property
+    def min(self):
+        return self.parent.refresh_scheduler.min_interval_ms
+
+    @property
+    def max(self):
+        return self.parent.refresh_scheduler.max_interval_ms
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return "ms"
@@ -13,13 +13,25 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-import collections
 import inspect
+import queue
+import sys
+import threading
 import time
+import tracemalloc
+import typing
 
-from ksysguard_mdraid_monitor import command, constants
+from ksysguard_mdraid_monitor import command, constants, export
 from ksysguard_mdraid_monitor.argument_parser import Namespace
-from ksysguard_mdraid_monitor.model import RaidStatus
+from ksysguard_mdraid_monitor.block_stat import BlockStatCollector
+from ksysguard_mdraid_monitor.group import ArrayGroupIndex, group_monitor_classes
+from ksysguard_mdraid_monitor.member_health import MemberHealthMonitor
+from ksysguard_mdraid_monitor.metrics_log import MetricsLog, array_state_values
+from ksysguard_mdraid_monitor.model import RaidStatus, read_proc_mdstat
+from ksysguard_mdraid_monitor.recording import MdstatRecorder, MdstatReplay
+from ksysguard_mdraid_monitor.scheduler import AdaptiveRefreshScheduler
+from ksysguard_mdraid_monitor.watch import WatchManager
+from ksysguard_mdraid_monitor.window import SensorWindows, parse_windowed_query
 
 
 class KSysGuardDaemon:
@@ -32,23 +44,93 @@ class KSysGuardDaemon:
     def __init__(self, args: Namespace):
         self.args = args
         self.command_table = self._build_command_table()
+        # Commands that take arguments. These are not part of the ksysguardd protocol, so stock KSysGuard never
+        # sends them. All other commands are dispatched through the command table, ignoring any arguments.
+        self.parametrized_command_table = {
+            "mget": self.command_mget,
+            "watch": self.command_watch,
+            "unwatch": self.command_unwatch,
+            "dump": self.command_dump,
+            "debug-memory": self.command_debug_memory,
+            "query": self.command_query,
+        }
         self.prompt = "ksysguardd> "
         self.run_main_loop = True
-        self.raid_status: RaidStatus = RaidStatus()
+        self.mdstat_source = self.create_mdstat_source(args)
+        self.recorder = MdstatRecorder(args.record) if args.record is not None else None
+        self.refresh_scheduler = AdaptiveRefreshScheduler(args.min_interval_ms, args.max_interval_ms)
+        self.raid_status: RaidStatus = self._create_raid_status(self.mdstat_source())
         self.raid_status_age = time.monotonic_ns()
+        self.array_groups = ArrayGroupIndex(args.groups, args.md_name_directory)
+        self.array_groups.update(self.raid_status)
+        self.array_io = BlockStatCollector(lambda device_name: args.sysfs_root / "block" / device_name / "stat")
+        self.member_health = MemberHealthMonitor(args.sysfs_root, args.slow_member_factor)
+        self._update_io_statistics(self.raid_status_age)
+        # Incremented each time the content of /proc/mdstat changes
+        self.raid_status_generation = 0
+        # Rendered dump outputs of the current generation, by format
+        self.dump_cache: typing.Dict[str, str] = {}
+        self.dump_cache_generation = 0
+        self.numeric_sensor_names: typing.List[str] = [
+            monitor.command for monitor in self.command_table.values()
+            if isinstance(monitor, command.AbstractMonitor) and monitor.output_type in ("integer", "float")
+        ]
+        self.metrics_log: typing.Optional[MetricsLog] = None
+        # Per-array values as last written to the metrics log. Only changes are written.
+        self.logged_array_state: typing.Dict[str, float] = {}
+        # Sensors depending on /proc/mdstat are logged on each change. All others are logged periodically.
+        self.mdstat_sensor_names = [
+            sensor_name for sensor_name in self.numeric_sensor_names
+            if self.command_table[sensor_name].derived_from_mdstat
+        ]
+        self.sampled_sensor_names = [
+            sensor_name for sensor_name in self.numeric_sensor_names
+            if not self.command_table[sensor_name].derived_from_mdstat
+        ]
+        self.sampled_sensors_log_age = 0
+        # Windowed statistics for "<sensor_name>@<window>" queries. Sensors depending on /proc/mdstat cost one
+        # evaluation per content change, so they are tracked from startup. All others, and with lazy parsing all
+        # sensors, are tracked from their first windowed query on, as evaluating them would parse each snapshot fully.
+        self.sensor_windows: typing.Dict[str, SensorWindows] = {}
+        self.sensor_windows_age = self.raid_status_age
+        if not args.lazy_parsing:
+            for sensor_name in self.mdstat_sensor_names:
+                self._track_sensor(sensor_name, self.raid_status_age)
+        if args.metrics_log is not None:
+            self.metrics_log = MetricsLog(args.metrics_log, args.metrics_log_max_size, args.metrics_log_keep)
+            self._append_metrics_log()
+            self._append_sampled_sensors_log(self.raid_status_age)
+        self.watch_manager = WatchManager()
+        # Set, once the first watch command is issued. Then input is read by a background thread.
+        self.input_queue: typing.Optional[queue.Queue] = None
 
-    def _build_command_table(self) -> collections.defaultdict:
+    @staticmethod
+    def create_mdstat_source(args: Namespace):
+        """Returns a callable that returns the current mdstat content."""
+        if args.replay is not None:
+            return MdstatReplay(args.replay, args.replay_speed).read
+        return read_proc_mdstat
+
+    def _create_raid_status(self, mdstat: str) -> RaidStatus:
+        raid_status = RaidStatus(mdstat, self.args.lazy_parsing)
+        if self.recorder is not None:
+            self.recorder.record(raid_status.mdstat)
+        return raid_status
 
-        # defaultdict calls the given function when instantiating the default value on unknown entries.
-        # So use lambda to wrap the error handler, so that all lookups in the table return function objects.
-        command_table = collections.defaultdict(lambda: self.command_not_found_error)
-        command_table.update({
+    def _build_command_table(self) -> typing.Dict[str, typing.Callable[[], None]]:
+        # Unknown commands are handled by execute_command(). Do not use a defaultdict for this, as it inserts
+        # each unknown command into the table, which then grows without bounds.
+        command_table = {
             "monitors": self.command_monitors,
             "quit": self.command_quit,
             "": lambda: (),  # Print nothing on empty input
-        })
+        }
         for class_ in self._get_all_monitor_classes():
-            self.register_monitor(command_table, class_)
+            self.register_monitor(command_table, class_(self))
+        # Group names in definition order, without duplicates
+        for group_name in dict.fromkeys(definition.group_name for definition in self.args.groups):
+            for class_ in group_monitor_classes:
+                self.register_monitor(command_table, class_(self, group_name))
 
         return command_table
 
@@ -72,27 +154,130 @@ class KSysGuardDaemon:
                  f"{constants.GPL_NOTICE}"
         print(header)
 
-    def register_monitor(self, command_table: collections.defaultdict, command_class: command.AbstractMonitor):
-        cmd = command_class(self)
+    @staticmethod
+    def register_monitor(command_table: typing.Dict[str, typing.Callable[[], None]], cmd: command.AbstractMonitor):
         command_table[cmd.command] = cmd
         command_table[f"{cmd.command}?"] = cmd.command_info
 
     def _read_raid_status(self):
         now = time.monotonic_ns()
-        if self.raid_status_age + self.args.min_interval_ms*1_000_000 <= now:
-            self.raid_status = RaidStatus()
+        if self.raid_status_age + self.refresh_scheduler.interval_ns <= now:
+            mdstat = self.mdstat_source()
+            content_changed = mdstat != self.raid_status.mdstat
+            if content_changed:
+                # Keep the already parsed status, if nothing changed
+                self.raid_status = self._create_raid_status(mdstat)
+                self.raid_status_generation += 1
+                self.array_groups.update(self.raid_status)
+                if self.metrics_log is not None:
+                    self._append_metrics_log()
+            self.raid_status_age = now
+            self.refresh_scheduler.update(self.raid_status, content_changed)
+            self._update_io_statistics(now)
+            self._update_sensor_windows(now, content_changed)
+            if self.metrics_log is not None and \
+                    self.sampled_sensors_log_age + self.args.metrics_log_interval * 1_000_000_000 <= now:
+                self._append_sampled_sensors_log(now)
+
+    def _update_io_statistics(self, now: int):
+        self.array_io.update([f"md{device.md_device}" for device in self.raid_status.device_info], now)
+        self.member_health.update(self.raid_status, now)
+
+    def _track_sensor(self, sensor_name: str, now: int):
+        """Starts tracking the windowed statistics of the given sensor with its current value."""
+        windows = self.sensor_windows[sensor_name] = SensorWindows()
+        windows.add(self.command_table[sensor_name].command_value, now)
+
+    def _update_sensor_windows(self, now: int, content_changed: bool):
+        # Sensors depending on /proc/mdstat are sampled on each change, so that short spikes are seen by min and max.
+        # All others are sampled once per second, as this is the resolution of the shortest window. Values are held
+        # until the next sample, and the average is weighted by time, so frequent changes do not dominate it.
+        sample_all = self.sensor_windows_age + 1_000_000_000 <= now
+        if sample_all:
+            self.sensor_windows_age = now
+        if content_changed or sample_all:
+            for sensor_name, windows in self.sensor_windows.items():
+                if sample_all or self.command_table[sensor_name].derived_from_mdstat:
+                    windows.add(self.command_table[sensor_name].command_value, now)
+
+    def _append_metrics_log(self):
+        """Logs the sensors depending on /proc/mdstat and the changed per-array values."""
+        values = [
+            (sensor_name, self.command_table[sensor_name].command_value) for sensor_name in self.mdstat_sensor_names
+        ]
+        array_state = array_state_values(self.raid_status)
+        values += [
+            (name, value) for name, value in array_state.items() if self.logged_array_state.get(name) != value
+        ]
+        self.logged_array_state = array_state
+        self.metrics_log.append(time.time(), values)
+
+    def _append_sampled_sensors_log(self, now: int):
+        """Logs the sensors that do not depend on /proc/mdstat, like the I/O sensors."""
+        self.sampled_sensors_log_age = now
+        self.metrics_log.append(time.time(), [
+            (sensor_name, self.command_table[sensor_name].command_value) for sensor_name in self.sampled_sensor_names
+        ])
 
     def main_loop(self):
         self._print_header()
         while self.run_main_loop:
             try:
-                read_command = input(self.prompt)
+                read_command = self._read_command()
             except EOFError:
                 self.command_quit()
             else:
-                self._read_raid_status()
-                read_command = self._preprocess_input_command(read_command)
-                self.command_table[read_command]()
+                self.handle_input_line(read_command)
+
+    def handle_input_line(self, read_command: str):
+        self._read_raid_status()
+        self.execute_command(read_command)
+
+    def _read_command(self) -> str:
+        if self.input_queue is None:
+            return input(self.prompt)
+        # Wait for input, while pushing the values of watched sensors when due
+        print(self.prompt, end="", flush=True)
+        while True:
+            try:
+                read_command = self.input_queue.get(timeout=self.watch_manager.seconds_until_next_push())
+            except queue.Empty:
+                self._push_watched_values()
+            else:
+                if read_command is None:
+                    raise EOFError
+                return read_command
+
+    def _start_input_thread(self):
+        self.input_queue = queue.Queue()
+        threading.Thread(target=self._read_input_lines, name="InputReader", daemon=True).start()
+
+    def _read_input_lines(self):
+        """Executed in the input reader thread. Forwards input lines to the main thread. None signals EOF."""
+        for line in sys.stdin:
+            self.input_queue.put(line.rstrip("\n"))
+        self.input_queue.put(None)
+
+    def _push_watched_values(self):
+        due_subscriptions = self.watch_manager.due_subscriptions()
+        if not due_subscriptions:
+            return
+        self._read_raid_status()
+        # Evaluate each sensor only once, regardless of the number of subscriptions watching it
+        sensor_names = {sensor_name for subscription in due_subscriptions for sensor_name in subscription.sensor_names}
+        values = {sensor_name: str(self.command_table[sensor_name].command_value) for sensor_name in sensor_names}
+        lines = [line for subscription in due_subscriptions for line in subscription.render(values)]
+        if lines:
+            print("\n".join(lines), flush=True)
+
+    def execute_command(self, read_command: str):
+        command_name = self._preprocess_input_command(read_command)
+        if command_name in self.parametrized_command_table:
+            self.parametrized_command_table[command_name](read_command.split()[1:])
+        elif command_name not in self.command_table and "@" in command_name:
+            self.command_windowed_query(command_name)
+        else:
+            self.command_table.get(command_name, self.command_not_found_error)()
 
     @staticmethod
     def _preprocess_input_command(read_command: str) -> str:
@@ -116,6 +301,129 @@ class KSysGuardDaemon:
             if isinstance(cmd, command.AbstractMonitor):
                 print(cmd.command_monitor_output)
 
+    def command_windowed_query(self, query: str):
+        """
+        Implements "<sensor_name>@<window>[:<statistic>]", like "SoftRaid/DegradedDevices@5m:max".
+        Windows are 1m, 5m, 15m and 1h. Statistics are min, max, avg (default) and last. Sensors not yet tracked are
+        tracked from their first windowed query on.
+        """
+        parsed_query = parse_windowed_query(query)
+        if parsed_query is None or parsed_query[0] not in self.numeric_sensor_names:
+            self.command_not_found_error()
+            return
+        sensor_name, window, statistic = parsed_query
+        now = time.monotonic_ns()
+        if sensor_name not in self.sensor_windows:
+            self._track_sensor(sensor_name, now)
+        value = self.sensor_windows[sensor_name].query(window, statistic, now)
+        print(int(value) if float(value).is_integer() else value)
+
+    def command_mget(self, sensor_names: typing.List[str]):
+        """
+        Prints the values of all given sensors, one per line in the given order. All values are taken from the same
+        RAID status snapshot. Unknown sensors result in "UNKNOWN COMMAND" lines. So do listview sensors, as their
+        values span multiple lines.
+        """
+        values = []
+        for sensor_name in sensor_names:
+            monitor = self.command_table.get(sensor_name)
+            if isinstance(monitor, command.AbstractMonitor) and monitor.output_type != "listview":
+                values.append(str(monitor.command_value))
+            else:
+                values.append("UNKNOWN COMMAND")
+        if values:
+            print("\n".join(values))
+
+    def command_watch(self, arguments: typing.List[str]):
+        """
+        Implements "watch [-c] <sensor_name...> <interval_ms>". Pushes the given sensors as "<sensor_name>\t<value>"
+        lines every interval, until "unwatch" is received. With -c, only sensors with changed values are pushed.
+        Listview sensors are rejected, as their values span multiple lines.
+        """
+        only_changes = bool(arguments) and arguments[0] == "-c"
+        if only_changes:
+            arguments = arguments[1:]
+        sensor_names, interval = arguments[:-1], arguments[-1:]
+        # Only scalar sensors can be pushed as a single line. Listview sensors span multiple lines.
+        valid_sensor_names = all(
+            isinstance(self.command_table.get(sensor_name), command.AbstractMonitor)
+            and self.command_table[sensor_name].output_type != "listview"
+            for sensor_name in sensor_names
+        )
+        if not sensor_names or not valid_sensor_names or not interval[0].isdigit() or not int(interval[0]):
+            self.command_not_found_error()
+            return
+        self.watch_manager.add(sensor_names, int(interval[0]), only_changes)
+        if self.input_queue is None:
+            self._start_input_thread()
+
+    def command_unwatch(self, arguments: typing.List[str]):
+        """Stops pushing all watched sensors."""
+        self.watch_manager.clear()
+
+    def command_dump(self, arguments: typing.List[str]):
+        """Implements "dump [json|csv]". Prints all aggregate and per-array values in the given format."""
+        output_format = arguments[0] if arguments else "json"
+        if output_format not in export.renderers:
+            self.command_not_found_error()
+            return
+        if self.dump_cache_generation != self.raid_status_generation:
+            self.dump_cache.clear()
+            self.dump_cache_generation = self.raid_status_generation
+        if output_format not in self.dump_cache:
+            self.dump_cache[output_format] = export.renderers[output_format](self.raid_status)
+        print(self.dump_cache[output_format])
+
+    def command_debug_memory(self, arguments: typing.List[str]):
+        """
+        Implements "debug-memory [count]". Prints the source lines that allocated the most memory still in use,
+        sorted by size. Defaults to 10 lines. Requires the --trace-memory command line argument.
+        """
+        if not tracemalloc.is_tracing():
+            print("Memory tracing is disabled. Start with --trace-memory to enable it.")
+            return
+        count = int(arguments[0]) if arguments and arguments[0].isdigit() else 10
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ))
+        total_size = sum(statistic.size for statistic in snapshot.statistics("filename"))
+        lines = [f"Total traced memory: {total_size} B"]
+        lines += [str(statistic) for statistic in snapshot.statistics("lineno")[:count]]
+        print("\n".join(lines))
+
+    def command_query(self, arguments: typing.List[str]):
+        """
+        Implements "query <sensor_name> <from> [<to>]". Prints all values of the given sensor in the metrics log, that
+        were logged within the given time range, as "<unix_timestamp>\t<value>" lines. from and to are unix
+        timestamps. Values of zero or less are relative to now, so "query <sensor_name> -3600" covers the last hour.
+        Besides all numeric sensors, per-array values like "md0/current_device_count" are logged.
+        """
+        if self.metrics_log is None:
+            print("The metrics log is disabled. Start with --metrics-log to enable it.")
+            return
+        try:
+            sensor_name, start, end = arguments[0], float(arguments[1]), float(arguments[2] if arguments[2:] else 0)
+        except (IndexError, ValueError):
+            self.command_not_found_error()
+            return
+        now = time.time()
+        start, end = (now + start if start <= 0 else start), (now + end if end <= 0 else end)
+        try:
+            logged_values = self.metrics_log.query(sensor_name, start, end)
+        except (ValueError, OSError) as e:
+            # A damaged or foreign log file must not end the session
+            print(f"Reading the metrics log failed: {e}")
+            return
+        lines = [
+            f"{timestamp:.3f}\t{int(value) if value.is_integer() else value}" for timestamp, value in logged_values
+        ]
+        if lines:
+            print("\n".join(lines))
+
     def command_quit(self):
         """Break the main loop"""
         self.run_main_loop = False
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.metrics_log is not None:
+            self.metrics_log.close()
@@ -0,0 +1,64 @@
+# Copyright (C) 2020 Thomas Hess <thomas.hess@udo.edu>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Serializes a RaidStatus snapshot into machine-readable formats."""
+
+import csv
+import inspect
+import io
+import json
+
+from ksysguard_mdraid_monitor.model import RaidDeviceInfo, RaidStatus
+
+# All aggregate values of a RaidStatus
+aggregate_fields = tuple(name for name, member in inspect.getmembers(RaidStatus) if isinstance(member, property))
+# All parsed fields of a RaidDeviceInfo, in the order of appearance in /proc/mdstat
+device_fields = tuple(RaidDeviceInfo.__annotations__) + ("component_count",)
+
+
+def snapshot_to_dict(raid_status: RaidStatus) -> dict:
+    return {
+        "aggregates": {name: getattr(raid_status, name) for name in aggregate_fields},
+        "devices": [{name: getattr(device, name) for name in device_fields} for device in raid_status.device_info],
+    }
+
+
+def render_json(raid_status: RaidStatus) -> str:
+    return json.dumps(snapshot_to_dict(raid_status))
+
+
+def render_csv(raid_status: RaidStatus) -> str:
+    """
+    Renders the snapshot as CSV with the columns "device", "field" and "value", one row per value.
+    The device column is empty for aggregate values. Lists are joined with spaces.
+    """
+    snapshot = snapshot_to_dict(raid_status)
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerow(("device", "field", "value"))
+    writer.writerows(("", name, value) for name, value in snapshot["aggregates"].items())
+    for device in snapshot["devices"]:
+        device_name = f"md{device['md_device']}"
+        writer.writerows(
+            (device_name, name, " ".join(value) if isinstance(value, list) else value)
+            for name, value in device.items()
+        )
+    return output.getvalue().rstrip("\n")
+
+
+renderers = {
+    "json": render_json,
+    "csv": render_csv,
+}
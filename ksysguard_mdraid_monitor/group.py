@@ -0,0 +1,225 @@
+# Copyright (C) 2020 Thomas Hess <thomas.hess@udo.edu>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Array groups, defined on the command line, and the aggregate sensors of each group.
+The monitors in this module are registered once per defined group, so they are deliberately not part of the command
+module, which holds the monitors registered exactly once.
+"""
+
+import fnmatch
+import os
+from pathlib import Path
+import typing
+
+from ksysguard_mdraid_monitor.command import AbstractMonitor
+from ksysguard_mdraid_monitor.model import RaidDeviceInfo, RaidStatus, bit_count
+
+# Arrays can be selected by raid level, by md device name pattern or by the name of the symlink in /dev/md
+GROUP_KINDS = ("level", "pattern", "name")
+
+
+class GroupDefinition(typing.NamedTuple):
+    group_name: str
+    kind: str
+    spec: str
+
+
+def group_definition(definition: str) -> GroupDefinition:
+    """
+    Parses a group definition like "data=level:raid6", "os=pattern:md[0-3]" or "scratch=name:scratch*".
+    Used as the argument type of --group.
+    """
+    group_name, _, selector = definition.partition("=")
+    kind, _, spec = selector.partition(":")
+    if not group_name or "/" in group_name or group_name.split() != [group_name] or kind not in GROUP_KINDS or not spec:
+        raise ValueError(f"Invalid group definition: {definition}")
+    return GroupDefinition(group_name, kind, spec)
+
+
+def read_md_names(md_name_directory: Path) -> typing.Dict[str, str]:
+    """
+    Returns the names of all named arrays, keyed by md device, like {"md127": "data"}. Named arrays have a symlink in
+    /dev/md pointing to the md device node. Returns an empty dict, if the directory does not exist.
+    """
+    try:
+        return {
+            os.path.basename(os.readlink(entry.path)): entry.name
+            for entry in os.scandir(md_name_directory) if entry.is_symlink()
+        }
+    except OSError:
+        return {}
+
+
+class GroupCounts(typing.NamedTuple):
+    total_device_count: int = 0
+    active_device_count: int = 0
+    degraded_device_count: int = 0
+    failed_component_count: int = 0
+    in_maintenance_device_count: int = 0
+
+
+class ArrayGroupIndex:
+    """
+    Maps each array to the groups it belongs to and maintains the aggregate counts of each group.
+    The mapping is only rebuilt, if the set of arrays changes. Counts are computed once per RAID status, so querying
+    a group sensor does not iterate over the arrays.
+    """
+    def __init__(self, definitions: typing.List[GroupDefinition], md_name_directory: Path):
+        self.definitions = definitions
+        self.md_name_directory = md_name_directory
+        self.group_names: typing.List[str] = list(dict.fromkeys(definition.group_name for definition in definitions))
+        # Key of the array set the index was built for: md device and raid level of each array
+        self._indexed_arrays: typing.Tuple[typing.Tuple[str, str], ...] = ()
+        # Group names of each array, in the order of RaidStatus.device_info
+        self._array_groups: typing.List[typing.Tuple[str, ...]] = []
+        self.counts: typing.Dict[str, GroupCounts] = {group_name: GroupCounts() for group_name in self.group_names}
+
+    def update(self, raid_status: RaidStatus):
+        if not self.definitions:
+            return
+        arrays = tuple((device.md_device, device.raid_level) for device in raid_status.device_info)
+        if arrays != self._indexed_arrays:
+            self._rebuild_index(arrays)
+        counts = {group_name: [0] * len(GroupCounts._fields) for group_name in self.group_names}
+        for device, group_names in zip(raid_status.device_info, self._array_groups):
+            if not group_names:
+                continue
+            device_counts = self._device_counts(device)
+            for group_name in group_names:
+                group_counts = counts[group_name]
+                for index, value in enumerate(device_counts):
+                    group_counts[index] += value
+        self.counts = {group_name: GroupCounts(*group_counts) for group_name, group_counts in counts.items()}
+
+    def _rebuild_index(self, arrays: typing.Tuple[typing.Tuple[str, str], ...]):
+        md_names = read_md_names(self.md_name_directory) if any(
+            definition.kind == "name" for definition in self.definitions) else {}
+        self._array_groups = [
+            tuple(dict.fromkeys(
+                definition.group_name for definition in self.definitions
+                if self._matches(definition, f"md{md_device}", raid_level, md_names)
+            ))
+            for md_device, raid_level in arrays
+        ]
+        self._indexed_arrays = arrays
+
+    @staticmethod
+    def _matches(definition: GroupDefinition, device_name: str, raid_level: str, md_names: typing.Dict[str, str]):
+        if definition.kind == "level":
+            return raid_level == definition.spec
+        if definition.kind == "pattern":
+            return fnmatch.fnmatchcase(device_name, definition.spec)
+        return device_name in md_names and fnmatch.fnmatchcase(md_names[device_name], definition.spec)
+
+    @staticmethod
+    def _device_counts(device: RaidDeviceInfo) -> typing.Tuple[int, ...]:
+        """Returns the contribution of a single array to the counts of its groups, in the order of GroupCounts."""
+        return (
+            1,
+            int(device.is_active),
+            int(device.current_device_count < device.expected_device_count),
+            bit_count(device.faulty_mask),
+            int(device.current_activity != "idle"),
+        )
+
+
+class AbstractGroupMonitor(AbstractMonitor):
+    """
+    Base class of the aggregate monitors of a single array group. Named "SoftRaid/Group/<group_name>/<sensor>".
+    Subclasses provide the sensor part of the name, the description and the reported GroupCounts field.
+    """
+    sensor: str
+    counts_field: str
+    group_description: str
+
+    def __init__(self, parent, group_name: str):
+        super(AbstractGroupMonitor, self).__init__(parent)
+        self.group_name = group_name
+
+    @property
+    def command(self) -> str:
+        return f"SoftRaid/Group/{self.group_name}/{self.sensor}"
+
+    @property
+    def command_value(self):
+        return getattr(self.parent.array_groups.counts[self.group_name], self.counts_field)
+
+    @property
+    def output_type(self) -> str:
+        return "integer"
+
+    @property
+    def description(self) -> str:
+        return f"{self.group_description} ({self.group_name})"
+
+    @property
+    def min(self):
+        return 0
+
+    @property
+    def max(self):
+        return self.parent.array_groups.counts[self.group_name].total_device_count
+
+    @property
+    def unit(self) -> typing.Optional[str]:
+        return None
+
+
+class GroupTotalDeviceCount(AbstractGroupMonitor):
+    sensor = "TotalDevices"
+    counts_field = "total_device_count"
+    group_description = "RAID devices"
+
+    @property
+    def max(self):
+        return self.parent.raid_status.total_device_count
+
+
+class GroupActiveDeviceCount(AbstractGroupMonitor):
+    sensor = "ActiveDevices"
+    counts_field = "active_device_count"
+    group_description = "Active RAID devices"
+
+
+class GroupDegradedDeviceCount(AbstractGroupMonitor):
+    sensor = "DegradedDevices"
+    counts_field = "degraded_device_count"
+    group_description = "Degraded RAID devices"
+
+
+class GroupFailedComponentCount(AbstractGroupMonitor):
+    sensor = "FailedComponents"
+    counts_field = "failed_component_count"
+    group_description = "Failed components"
+
+    @property
+    def max(self):
+        return self.parent.raid_status.total_component_count
+
+
+class GroupInMaintenanceDeviceCount(AbstractGroupMonitor):
+    sensor = "InMaintenance"
+    counts_field = "in_maintenance_device_count"
+    group_description = "RAID devices in maintenance"
+
+
+group_monitor_classes = (
+    GroupTotalDeviceCount,
+    GroupActiveDeviceCount,
+    GroupDegradedDeviceCount,
+    GroupFailedComponentCount,
+    GroupInMaintenanceDeviceCount,
+)
@@ -0,0 +1,505 @@
+# Copyright (C) 2020 Thomas Hess <thomas.hess@udo.edu>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measurement harness for the monitor. Starts the monitor as a subprocess, replaying a synthetic /proc/mdstat recording,
+and drives it through a pipe, like KSysGuard does. The soak test runs the monitor in-process instead, to be able to
+trace memory allocations. Results are printed as JSON.
+
+Run it with: python -m ksysguard_mdraid_monitor.harness --help
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import os
+from pathlib import Path
+import random
+import resource
+import select
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing
+
+from ksysguard_mdraid_monitor import argument_parser
+from ksysguard_mdraid_monitor.argument_parser import NonNegativeInt, PositiveFloat, PositiveInt
+from ksysguard_mdraid_monitor.daemon import KSysGuardDaemon
+from ksysguard_mdraid_monitor.recording import MdstatRecorder
+
+PROMPT = b"ksysguardd> "
+
+
+def generate_mdstat(array_count: int, resync_progress: float) -> str:
+    """
+    Returns a synthetic /proc/mdstat with the given number of raid 1 arrays. The first array performs a resync,
+    which is at the given progress in percent.
+    """
+    lines = ["Personalities : [raid1]"]
+    total_blocks = 1953383488
+    for md_device in range(array_count):
+        lines.append(f"md{md_device} : active raid1 sd{md_device}b1[1] sd{md_device}a1[0]")
+        lines.append(f"      {total_blocks} blocks super 1.2 [2/2] [UU]")
+        if md_device == 0 and resync_progress < 100:
+            current_block = int(total_blocks * resync_progress / 100)
+            lines.append(
+                f"      [>....................]  resync = {resync_progress:4.1f}% ({current_block}/{total_blocks}) "
+                f"finish=213.6min speed=150885K/sec")
+        lines.append("      bitmap: 15/15 pages [60KB], 65536KB chunk")
+        lines.append("")
+    lines.append("unused devices: <none>")
+    return "\n".join(lines) + "\n"
+
+
+def write_synthetic_recording(path: Path, array_count: int, snapshot_count: int, snapshot_interval_s: float):
+    """Writes a recording of a resync running on the first array, with snapshot_count snapshots."""
+    timestamps = iter(range(snapshot_count))
+    recorder = MdstatRecorder(path, clock=lambda: next(timestamps) * snapshot_interval_s)
+    for snapshot in range(snapshot_count):
+        recorder.record(generate_mdstat(array_count, 100 * snapshot / snapshot_count))
+    recorder.close()
+
+
+def get_all_sensor_names(scalar_only: bool = False) -> typing.List[str]:
+    """Returns the names of all sensors. With scalar_only, listview sensors are excluded, as they can not be watched."""
+    # The command name and output type do not depend on the daemon, so no parent is required
+    monitors = [class_(None) for class_ in KSysGuardDaemon._get_all_monitor_classes()]
+    return sorted(
+        monitor.command for monitor in monitors if not scalar_only or monitor.output_type != "listview")
+
+
+class DaemonProcess:
+    """The monitor running as a subprocess. Counts the traffic through the pipe in both directions."""
+    def __init__(self, monitor_arguments: typing.List[str]):
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._buffer = b""
+        self._rusage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "ksysguard_mdraid_monitor", *monitor_arguments],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0
+        )
+        # Skip the header
+        self.read_response()
+
+    def send(self, line: str):
+        data = f"{line}\n".encode("ascii")
+        self.process.stdin.write(data)
+        self.bytes_sent += len(data)
+
+    def _read_available(self) -> bytes:
+        data = os.read(self.process.stdout.fileno(), 65536)
+        if not data:
+            raise EOFError("The monitor closed its output.")
+        self.bytes_received += len(data)
+        return data
+
+    def read_response(self) -> bytes:
+        """Reads until the next prompt and returns everything before it."""
+        while PROMPT not in self._buffer:
+            self._buffer += self._read_available()
+        response, self._buffer = self._buffer.split(PROMPT, 1)
+        return response
+
+    def read_for(self, duration_s: float) -> bytes:
+        """Reads all output that arrives within the given duration."""
+        end = time.monotonic() + duration_s
+        data = self._buffer
+        self._buffer = b""
+        remaining = duration_s
+        while remaining > 0:
+            readable, _, _ = select.select([self.process.stdout], [], [], remaining)
+            if readable:
+                data += self._read_available()
+            remaining = end - time.monotonic()
+        return data
+
+    def close(self) -> float:
+        """Quits the monitor and returns the CPU time in seconds used by it."""
+        self.send("quit")
+        self.process.stdin.close()
+        # Drain the output, so that the monitor can not block on a full pipe
+        self.bytes_received += len(self.process.stdout.read())
+        self.process.wait()
+        rusage_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return rusage_after.ru_utime + rusage_after.ru_stime \
+            - self._rusage_before.ru_utime - self._rusage_before.ru_stime
+
+
+def run_polling(monitor_arguments: typing.List[str], sensor_names: typing.List[str], interval_s: float,
+                duration_s: float) -> dict:
+    """Queries each sensor with a single command each interval, like KSysGuard does."""
+    daemon = DaemonProcess(monitor_arguments)
+    end = time.monotonic() + duration_s
+    next_tick = time.monotonic()
+    ticks = 0
+    while next_tick < end:
+        time.sleep(max(0.0, next_tick - time.monotonic()))
+        for sensor_name in sensor_names:
+            daemon.send(sensor_name)
+            daemon.read_response()
+        ticks += 1
+        next_tick += interval_s
+    cpu_seconds = daemon.close()
+    return {
+        "ticks": ticks,
+        "bytes_sent": daemon.bytes_sent,
+        "bytes_received": daemon.bytes_received,
+        "cpu_seconds": cpu_seconds,
+    }
+
+
+def run_watch(monitor_arguments: typing.List[str], sensor_names: typing.List[str], interval_s: float,
+              duration_s: float, only_changes: bool) -> dict:
+    """Subscribes to all sensors once and receives the pushed values."""
+    daemon = DaemonProcess(monitor_arguments)
+    flags = ["-c"] if only_changes else []
+    daemon.send(" ".join(["watch", *flags, *sensor_names, str(round(interval_s * 1000))]))
+    pushed_lines = daemon.read_for(duration_s).count(b"\n")
+    cpu_seconds = daemon.close()
+    return {
+        "pushed_lines": pushed_lines,
+        "bytes_sent": daemon.bytes_sent,
+        "bytes_received": daemon.bytes_received,
+        "cpu_seconds": cpu_seconds,
+    }
+
+
+def command_watch(args: argparse.Namespace) -> dict:
+    sensor_names = get_all_sensor_names(scalar_only=True)
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        recording = Path(temporary_directory, "recording.jsonl")
+        snapshot_count = max(1, args.snapshots)
+        write_synthetic_recording(recording, args.arrays, snapshot_count, args.duration / snapshot_count)
+        monitor_arguments = ["--replay", str(recording)]
+        polling = run_polling(monitor_arguments, sensor_names, args.interval, args.duration)
+        watch = run_watch(monitor_arguments, sensor_names, args.interval, args.duration, args.only_changes)
+    polling_traffic = polling["bytes_sent"] + polling["bytes_received"]
+    watch_traffic = watch["bytes_sent"] + watch["bytes_received"]
+    return {
+        "sensors": len(sensor_names),
+        "arrays": args.arrays,
+        "interval_s": args.interval,
+        "duration_s": args.duration,
+        "only_changes": args.only_changes,
+        "polling": polling,
+        "watch": watch,
+        "traffic_reduction": 1 - watch_traffic / polling_traffic if polling_traffic else 0,
+        "cpu_reduction": 1 - watch["cpu_seconds"] / polling["cpu_seconds"] if polling["cpu_seconds"] else 0,
+    }
+
+
+def generate_command_mix(sensor_names: typing.List[str], count: int, seed: int) -> typing.List[str]:
+    """
+    Returns a random sequence of commands, resembling the traffic caused by KSysGuard: Mostly sensor reads,
+    some info requests, rare "monitors" commands and a few unknown commands.
+    """
+    generator = random.Random(seed)
+    command_kinds = generator.choices(("read", "info", "monitors", "unknown"), weights=(90, 4, 1, 5), k=count)
+    commands = []
+    for kind in command_kinds:
+        if kind == "read":
+            commands.append(generator.choice(sensor_names))
+        elif kind == "info":
+            commands.append(f"{generator.choice(sensor_names)}?")
+        elif kind == "monitors":
+            commands.append("monitors")
+        else:
+            commands.append(f"SoftRaid/Unknown{generator.randrange(count)}")
+    return commands
+
+
+def percentile(sorted_values: typing.List[float], percent: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(percent / 100 * len(sorted_values)) - 1)]
+
+
+def measure_startup_cpu(monitor_arguments: typing.List[str]) -> float:
+    """Returns the CPU time used by starting and immediately quitting the monitor."""
+    return DaemonProcess(monitor_arguments).close()
+
+
+def run_throughput(monitor_arguments: typing.List[str], commands: typing.List[str], rate: float) -> dict:
+    """
+    Sends the commands one by one and waits for each response. With a positive rate, commands are sent on a fixed
+    schedule of rate commands per second. Otherwise, the next command is sent as soon as the response arrived.
+    """
+    daemon = DaemonProcess(monitor_arguments)
+    latencies_us = []
+    start = time.monotonic()
+    for index, command in enumerate(commands):
+        if rate > 0:
+            time.sleep(max(0.0, start + index / rate - time.monotonic()))
+        sent = time.perf_counter()
+        daemon.send(command)
+        daemon.read_response()
+        latencies_us.append((time.perf_counter() - sent) * 1_000_000)
+    duration_s = time.monotonic() - start
+    cpu_seconds = daemon.close()
+    latencies_us.sort()
+    return {
+        "commands": len(commands),
+        "duration_s": duration_s,
+        "commands_per_s": len(commands) / duration_s if duration_s else 0,
+        "latency_us": {
+            "p50": percentile(latencies_us, 50),
+            "p90": percentile(latencies_us, 90),
+            "p99": percentile(latencies_us, 99),
+            "max": latencies_us[-1] if latencies_us else 0.0,
+        },
+        "cpu_seconds": cpu_seconds,
+        "bytes_sent": daemon.bytes_sent,
+        "bytes_received": daemon.bytes_received,
+    }
+
+
+def command_throughput(args: argparse.Namespace) -> dict:
+    sensor_names = get_all_sensor_names()
+    commands = generate_command_mix(sensor_names, args.commands, args.seed)
+    runs = []
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        for array_count in args.array_counts:
+            recording = Path(temporary_directory, f"recording-{array_count}.jsonl")
+            # One snapshot per recorded second, so that the replay speed equals the snapshot change rate.
+            write_synthetic_recording(recording, array_count, max(1, args.snapshots), 1)
+            replay_arguments = ["--replay", str(recording), "--replay-speed", str(args.change_rate)]
+            for min_interval_ms in args.min_intervals:
+                # Use a fixed refresh interval, so that the adaptive interval does not affect the measurement.
+                monitor_arguments = [*replay_arguments, "-i", str(min_interval_ms), "-I", str(min_interval_ms)]
+                startup_cpu_seconds = measure_startup_cpu(monitor_arguments)
+                run = run_throughput(monitor_arguments, commands, args.rate)
+                command_cpu_seconds = max(0.0, run["cpu_seconds"] - startup_cpu_seconds)
+                run.update({
+                    "arrays": array_count,
+                    "min_interval_ms": min_interval_ms,
+                    "startup_cpu_seconds": startup_cpu_seconds,
+                    "cpu_us_per_command": command_cpu_seconds / len(commands) * 1_000_000 if commands else 0.0,
+                })
+                runs.append(run)
+    return {
+        "commands": args.commands,
+        "rate": args.rate,
+        "change_rate": args.change_rate,
+        "seed": args.seed,
+        "runs": runs,
+    }
+
+
+def read_rss_bytes() -> int:
+    """Returns the resident set size of this process."""
+    with open("/proc/self/statm", encoding="ascii") as statm:
+        resident_pages = int(statm.read().split()[1])
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def memory_growth(samples: typing.List[int]) -> int:
+    """
+    Returns the growth between the mean of the first and the mean of the last quarter of the samples.
+    The first 10% of the samples are skipped as warm-up, during which caches are populated.
+    """
+    samples = samples[len(samples) // 10:]
+    quarter = len(samples) // 4
+    if not quarter:
+        return 0
+    return sum(samples[-quarter:]) // quarter - sum(samples[:quarter]) // quarter
+
+
+def command_soak(args: argparse.Namespace) -> dict:
+    sensor_names = get_all_sensor_names()
+    commands = generate_command_mix(sensor_names, args.commands, args.seed)
+    # Mix in the non-standard commands, as these use caches
+    for index in range(0, len(commands), 100):
+        commands[index] = f"mget {' '.join(sensor_names)}"
+    for index in range(50, len(commands), 1000):
+        commands[index] = "dump csv" if index % 2000 == 50 else "dump json"
+    for index in range(25, len(commands), 100):
+        commands[index] = f"{sensor_names[index % len(sensor_names)]}@5m:max"
+    snapshot_count = max(1, args.snapshots)
+    snapshots = [generate_mdstat(args.arrays, 100 * snapshot / snapshot_count) for snapshot in range(snapshot_count)]
+    commands_per_snapshot = max(1, args.commands // (snapshot_count * args.cycles))
+    command_index = 0
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        recording = Path(temporary_directory, "recording.jsonl")
+        write_synthetic_recording(recording, args.arrays, 1, 1)
+        # Refresh on every command, so that every snapshot change is seen by the monitor
+        monitor_args = argument_parser.parse_arguments(["--replay", str(recording), "-i", "0", "-I", "0"])
+        daemon = KSysGuardDaemon(monitor_args)
+    daemon.mdstat_source = lambda: snapshots[command_index // commands_per_snapshot % snapshot_count]
+
+    traced_samples = []
+    rss_samples = []
+    tracemalloc.start()
+    first_snapshot = None
+    start = time.monotonic()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for command_index, command in enumerate(commands):
+            daemon.handle_input_line(command)
+            if not command_index % args.sample_every:
+                traced_samples.append(tracemalloc.get_traced_memory()[0])
+                rss_samples.append(read_rss_bytes())
+                if first_snapshot is None and len(traced_samples) * 10 >= len(commands) // args.sample_every:
+                    # Compare against a snapshot taken after the warm-up
+                    first_snapshot = tracemalloc.take_snapshot()
+    duration_s = time.monotonic() - start
+    last_snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    traced_growth = memory_growth(traced_samples)
+    rss_growth = memory_growth(rss_samples)
+    top_growth = last_snapshot.compare_to(first_snapshot, "lineno")[:10] if first_snapshot is not None else []
+    return {
+        "commands": len(commands),
+        "snapshot_changes": len(commands) // commands_per_snapshot,
+        "arrays": args.arrays,
+        "duration_s": duration_s,
+        "traced_memory_growth_bytes": traced_growth,
+        "rss_growth_bytes": rss_growth,
+        "traced_memory_samples": traced_samples,
+        "rss_samples": rss_samples,
+        "top_allocations": [str(statistic) for statistic in last_snapshot.statistics("lineno")[:10]],
+        "top_growth": [str(statistic) for statistic in top_growth],
+        "passed": traced_growth <= args.max_traced_growth and rss_growth <= args.max_rss_growth,
+    }
+
+
+def generate_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m ksysguard_mdraid_monitor.harness",
+        description="Measures the monitor, driven through a pipe with a synthetic /proc/mdstat recording."
+    )
+    parser.add_argument(
+        "-o", "--output", metavar="FILE", type=Path,
+        help="Write the JSON result to FILE instead of printing it."
+    )
+    parser.add_argument(
+        "--arrays", metavar="COUNT", type=NonNegativeInt, default=NonNegativeInt(4),
+        help="Number of RAID arrays in the synthetic /proc/mdstat. Defaults to %(default)i."
+    )
+    subparsers = parser.add_subparsers(dest="harness_command", required=True)
+
+    watch_parser = subparsers.add_parser(
+        "watch", help="Compare the traffic and CPU time of polling every sensor with a watch subscription."
+    )
+    watch_parser.set_defaults(run=command_watch)
+    watch_parser.add_argument(
+        "--interval", metavar="SECONDS", type=PositiveFloat, default=PositiveFloat(1),
+        help="Polling and push interval. Defaults to %(default)g seconds."
+    )
+    watch_parser.add_argument(
+        "--duration", metavar="SECONDS", type=PositiveFloat, default=PositiveFloat(10),
+        help="Duration of each measurement. Defaults to %(default)g seconds."
+    )
+    watch_parser.add_argument(
+        "--snapshots", metavar="COUNT", type=NonNegativeInt, default=NonNegativeInt(20),
+        help="Number of distinct /proc/mdstat snapshots replayed during the measurement. Defaults to %(default)i."
+    )
+    watch_parser.add_argument(
+        "-c", "--only-changes", action="store_true",
+        help="Only push changed values in the watch subscription."
+    )
+
+    throughput_parser = subparsers.add_parser(
+        "throughput",
+        help="Measure commands per second, latency percentiles and CPU time per command for a realistic command mix."
+    )
+    throughput_parser.set_defaults(run=command_throughput)
+    throughput_parser.add_argument(
+        "--commands", metavar="COUNT", type=NonNegativeInt, default=NonNegativeInt(10000),
+        help="Number of commands sent per run. Defaults to %(default)i."
+    )
+    throughput_parser.add_argument(
+        "--rate", metavar="COMMANDS_PER_SECOND", type=float, default=0.0,
+        help="Send commands at this fixed rate. Defaults to 0, which sends each command as soon as the previous "
+             "response arrived."
+    )
+    throughput_parser.add_argument(
+        "--array-counts", metavar="COUNT", type=NonNegativeInt, nargs="+", default=[1, 4, 16, 64],
+        help="Perform a run for each given number of RAID arrays in the synthetic /proc/mdstat. "
+             "Defaults to %(default)s."
+    )
+    throughput_parser.add_argument(
+        "--min-intervals", metavar="MILLISECONDS", type=NonNegativeInt, nargs="+", default=[0, 10, 100],
+        help="Perform a run for each given --min-interval value of the monitor. Defaults to %(default)s."
+    )
+    throughput_parser.add_argument(
+        "--change-rate", metavar="SNAPSHOTS_PER_SECOND", type=PositiveFloat, default=PositiveFloat(10),
+        help="Rate at which the synthetic /proc/mdstat content changes. Defaults to %(default)g per second."
+    )
+    throughput_parser.add_argument(
+        "--snapshots", metavar="COUNT", type=NonNegativeInt, default=NonNegativeInt(1000),
+        help="Number of distinct /proc/mdstat snapshots in the synthetic recording. Defaults to %(default)i."
+    )
+    throughput_parser.add_argument(
+        "--seed", metavar="NUMBER", type=int, default=0,
+        help="Seed of the random command mix. Runs with the same seed send the same commands. Defaults to %(default)i."
+    )
+
+    soak_parser = subparsers.add_parser(
+        "soak",
+        help="Run the monitor in-process with many commands and snapshot changes, while tracking the memory usage. "
+             "Fails with exit code 1, if the memory usage keeps growing."
+    )
+    soak_parser.set_defaults(run=command_soak)
+    soak_parser.add_argument(
+        "--commands", metavar="COUNT", type=NonNegativeInt, default=NonNegativeInt(1_000_000),
+        help="Number of commands executed. Defaults to %(default)i."
+    )
+    soak_parser.add_argument(
+        "--snapshots", metavar="COUNT", type=NonNegativeInt, default=NonNegativeInt(1000),
+        help="Number of distinct /proc/mdstat snapshots. Defaults to %(default)i."
+    )
+    soak_parser.add_argument(
+        "--cycles", metavar="COUNT", type=PositiveInt, default=PositiveInt(5),
+        help="Number of times all snapshots are cycled through during the run. Defaults to %(default)i."
+    )
+    soak_parser.add_argument(
+        "--sample-every", metavar="COMMANDS", type=PositiveInt, default=PositiveInt(10000),
+        help="Sample the memory usage every this many commands. Defaults to %(default)i."
+    )
+    soak_parser.add_argument(
+        "--max-traced-growth", metavar="BYTES", type=NonNegativeInt, default=NonNegativeInt(256 * 1024),
+        help="Maximal tolerated growth of the memory allocated by Python. Defaults to %(default)i bytes."
+    )
+    soak_parser.add_argument(
+        "--max-rss-growth", metavar="BYTES", type=NonNegativeInt, default=NonNegativeInt(8 * 1024 * 1024),
+        help="Maximal tolerated growth of the resident set size. Defaults to %(default)i bytes."
+    )
+    soak_parser.add_argument(
+        "--seed", metavar="NUMBER", type=int, default=0,
+        help="Seed of the random command mix. Defaults to %(default)i."
+    )
+    return parser
+
+
+def main():
+    args = generate_argument_parser().parse_args()
+    result = args.run(args)
+    output = json.dumps(result, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output + "\n", encoding="utf-8")
+    if result.get("passed") is False:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
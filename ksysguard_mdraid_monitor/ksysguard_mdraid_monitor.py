@@ -16,12 +16,23 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import tracemalloc
+
+from ksysguard_mdraid_monitor import export
 from ksysguard_mdraid_monitor.argument_parser import parse_arguments
 from ksysguard_mdraid_monitor.daemon import KSysGuardDaemon
+from ksysguard_mdraid_monitor.model import RaidStatus
 
 
 def main():
     args = parse_arguments()
+    if args.once:
+        # Skip the daemon setup entirely
+        mdstat = KSysGuardDaemon.create_mdstat_source(args)()
+        print(export.renderers[args.format](RaidStatus(mdstat)))
+        return
+    if args.trace_memory:
+        tracemalloc.start()
     daemon = KSysGuardDaemon(args)
     daemon.main_loop()
 
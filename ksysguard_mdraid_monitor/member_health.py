@@ -0,0 +1,76 @@
+# Copyright (C) 2020 Thomas Hess <thomas.hess@udo.edu>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from array import array
+from pathlib import Path
+import typing
+
+from ksysguard_mdraid_monitor.block_stat import BlockStatCollector
+from ksysguard_mdraid_monitor.model import RaidStatus
+
+# Members with fewer requests per second or a lower average wait time are never flagged, as their statistics are
+# dominated by noise.
+MIN_IOPS = 1.0
+MIN_WAIT_MS = 1.0
+
+
+class MemberHealthMonitor:
+    """
+    Samples the I/O statistics of all RAID component devices and flags slow members. A member is slow, if its average
+    I/O wait time exceeds the mean wait time of its siblings in the same array by the given factor.
+    Member statistics are read from /sys/class/block/<member>/stat, which also covers partitions.
+    """
+    def __init__(self, sysfs_root: Path, slow_factor: float):
+        self.slow_factor = slow_factor
+        self.io = BlockStatCollector(lambda device_name: sysfs_root / "class" / "block" / device_name / "stat")
+        # Array of each member, indexed like self.io.device_names
+        self.member_arrays: typing.List[str] = []
+        self.slow = array("B")
+
+    def update(self, raid_status: RaidStatus, now_ns: int):
+        member_names = []
+        member_arrays = []
+        for device in raid_status.device_info:
+            for component_name in device.component_names:
+                member_names.append(component_name)
+                member_arrays.append(f"md{device.md_device}")
+        self.io.update(member_names, now_ns)
+        self.member_arrays = member_arrays
+        self._flag_slow_members()
+
+    def _flag_slow_members(self):
+        wait = self.io.average_wait_ms
+        busy = [read + write >= MIN_IOPS for read, write in zip(self.io.read_iops, self.io.write_iops)]
+        members_by_array: typing.Dict[str, typing.List[int]] = {}
+        for member, array_name in enumerate(self.member_arrays):
+            if busy[member]:
+                members_by_array.setdefault(array_name, []).append(member)
+        self.slow = array("B", [0] * len(self.member_arrays))
+        for members in members_by_array.values():
+            if len(members) < 2:
+                continue
+            total_wait = sum(wait[member] for member in members)
+            for member in members:
+                sibling_mean_wait = (total_wait - wait[member]) / (len(members) - 1)
+                if wait[member] >= MIN_WAIT_MS and wait[member] > self.slow_factor * sibling_mean_wait:
+                    self.slow[member] = 1
+
+    @property
+    def slow_member_count(self) -> int:
+        return sum(self.slow)
+
+    @property
+    def device_with_slow_members_count(self) -> int:
+        return len({array_name for array_name, slow in zip(self.member_arrays, self.slow) if slow})
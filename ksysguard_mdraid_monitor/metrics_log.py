@@ -0,0 +1,187 @@
+# Copyright (C) 2020 Thomas Hess <thomas.hess@udo.edu>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Durable, append-only log of sensor values.
+
+The log file starts with a header, followed by fixed-width records. Each record holds a unix timestamp, the CRC32 of
+the sensor name and the value. Records are grouped into blocks of BLOCK_RECORDS records. The first record of each block
+is an index record holding the timestamp of the first data record in the block. Because records are appended in
+chronological order, a query uses a binary search over the index records to find the first relevant block, instead of
+scanning the whole file. Timestamps never decrease: If the system clock steps backwards, values are logged with the
+latest logged timestamp until the clock catches up. When the log exceeds its maximum size, it is rotated: "log" becomes
+"log.1", "log.1" becomes "log.2" and so on. An existing log file with a different header, like one of another format
+version, is renamed to "log.invalid" and a new log is started.
+"""
+
+import io
+import math
+import mmap
+from pathlib import Path
+import struct
+import typing
+import zlib
+
+from ksysguard_mdraid_monitor.model import RaidStatus, bit_count
+
+HEADER = struct.Struct("<8sII")  # Magic, format version, records per block
+MAGIC = b"MDRAIDLG"
+VERSION = 1
+RECORD = struct.Struct("<dId")  # Unix timestamp, key, value
+BLOCK_RECORDS = 256
+INDEX_KEY = 0xFFFFFFFF
+# Numeric representation of the array activity. Unknown activities are logged as -1.
+ACTIVITY_CODES = {
+    "idle": 0,
+    "check": 1,
+    "resync": 2,
+    "recovery": 3,
+    "reshape": 4,
+    "repair": 5,
+}
+
+
+def sensor_key(sensor_name: str) -> int:
+    return zlib.crc32(sensor_name.encode("utf-8"))
+
+
+def array_state_values(raid_status: RaidStatus) -> typing.Dict[str, float]:
+    """Returns the logged per-array values, named like "md0/current_device_count"."""
+    values = {}
+    for device in raid_status.device_info:
+        prefix = f"md{device.md_device}/"
+        values[f"{prefix}is_active"] = device.is_active
+        values[f"{prefix}expected_device_count"] = device.expected_device_count
+        values[f"{prefix}current_device_count"] = device.current_device_count
+        values[f"{prefix}failed_component_count"] = bit_count(device.faulty_mask)
+        values[f"{prefix}activity"] = ACTIVITY_CODES.get(device.current_activity, -1)
+        values[f"{prefix}progress_percent"] = device.progress_percent
+    return values
+
+
+class MetricsLog:
+    """Appends sensor values to a log file and queries them."""
+    def __init__(self, path: Path, max_size: int, keep: int):
+        self.path = path
+        self.max_size = max_size
+        self.keep = keep
+        self._file = None
+        self._record_count = 0
+        # Timestamp of the last appended record. Used to keep the timestamps in order, if the clock steps backwards.
+        self._last_timestamp = -math.inf
+        self._open()
+
+    def _open(self):
+        # Writes always append, but the header and the last record can be read back
+        self._file = self.path.open("a+b")
+        size = self._file.tell()
+        if size >= HEADER.size:
+            self._file.seek(0)
+            if HEADER.unpack(self._file.read(HEADER.size)) != (MAGIC, VERSION, BLOCK_RECORDS):
+                # Do not append records in a format the file does not declare. Keep it for inspection.
+                self._file.close()
+                self.path.replace(self.path.with_name(f"{self.path.name}.invalid"))
+                self._file = self.path.open("a+b")
+                size = 0
+        if size < HEADER.size:
+            self._file.truncate(0)
+            self._file.write(HEADER.pack(MAGIC, VERSION, BLOCK_RECORDS))
+            size = HEADER.size
+        self._record_count, partial_record = divmod(size - HEADER.size, RECORD.size)
+        if partial_record:
+            # The last record was only partially written, for example due to a crash. Discard it.
+            self._file.truncate(size - partial_record)
+        if self._record_count:
+            self._file.seek(HEADER.size + (self._record_count - 1) * RECORD.size)
+            self._last_timestamp = max(self._last_timestamp, RECORD.unpack(self._file.read(RECORD.size))[0])
+        self._file.seek(0, io.SEEK_END)
+
+    def _rotate(self):
+        self._file.close()
+        oldest = self._rotated_path(self.keep)
+        if oldest.exists():
+            # If no rotated files are kept, this is the current log file.
+            oldest.unlink()
+        for number in range(self.keep, 0, -1):
+            newer = self._rotated_path(number - 1)
+            if newer.exists():
+                newer.rename(self._rotated_path(number))
+        self._open()
+
+    def _rotated_path(self, number: int) -> Path:
+        return self.path if not number else self.path.with_name(f"{self.path.name}.{number}")
+
+    def append(self, timestamp: float, values: typing.Iterable[typing.Tuple[str, float]]):
+        """
+        Appends the given (sensor name, value) pairs, all taken at the given time. If the given time lies before the
+        last logged timestamp, the last logged timestamp is used instead.
+        """
+        if self._file.tell() >= self.max_size:
+            self._rotate()
+        timestamp = self._last_timestamp = max(timestamp, self._last_timestamp)
+        records = []
+        for sensor_name, value in values:
+            if not self._record_count % BLOCK_RECORDS:
+                records.append(RECORD.pack(timestamp, INDEX_KEY, self._record_count // BLOCK_RECORDS))
+                self._record_count += 1
+            records.append(RECORD.pack(timestamp, sensor_key(sensor_name), value))
+            self._record_count += 1
+        self._file.write(b"".join(records))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def query(self, sensor_name: str, start: float, end: float) -> typing.List[typing.Tuple[float, float]]:
+        """Returns all (timestamp, value) pairs of the given sensor with start <= timestamp <= end."""
+        key = sensor_key(sensor_name)
+        result = []
+        # Oldest file first, to return the values in chronological order
+        for number in range(self.keep, -1, -1):
+            path = self._rotated_path(number)
+            if path.exists():
+                result += self._query_file(path, key, start, end)
+        return result
+
+    @staticmethod
+    def _query_file(path: Path, key: int, start: float, end: float) -> typing.List[typing.Tuple[float, float]]:
+        with path.open("rb") as log_file:
+            record_count = (path.stat().st_size - HEADER.size) // RECORD.size
+            if record_count <= 0:
+                return []
+            with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as log:
+                magic, version, block_records = HEADER.unpack_from(log, 0)
+                if magic != MAGIC or version != VERSION:
+                    raise ValueError(f"{path} is not a metrics log of a supported version.")
+
+                def record_time(record: int) -> float:
+                    return RECORD.unpack_from(log, HEADER.size + record * RECORD.size)[0]
+
+                # Binary search for the last block starting before start. Earlier blocks can not contain matches.
+                low, high = 0, (record_count - 1) // block_records
+                while low < high:
+                    middle = (low + high + 1) // 2
+                    if record_time(middle * block_records) < start:
+                        low = middle
+                    else:
+                        high = middle - 1
+                result = []
+                for record in range(low * block_records, record_count):
+                    timestamp, record_key, value = RECORD.unpack_from(log, HEADER.size + record * RECORD.size)
+                    if timestamp > end:
+                        break
+                    if record_key == key and timestamp >= start:
+                        result.append((timestamp, value))
+                return result
@@ -15,6 +15,7 @@
 
 from pathlib import Path
 import re
+import typing
 
 
 proc_mdstat_path = Path("/", "proc", "mdstat")
@@ -23,63 +24,170 @@ header_parser = re.compile(  # Parses the first line of each block, beginning wi
     r"^md(?P<md_device>[1-9][0-9]+|[0-9]) : (?P<is_active>(in)?active) (?P<level>[a-z0-9]*)(?P<components> .*)"
 )
 block_parser = re.compile(
-    r"^(?P<block_count>\d+) blocks "  # total block count
-    r"(super (?P<superblock_format>\d+.\d+) )?"  # Optional superblock format
-    r"(?P<level>linear|faulty|multipath|level \d+)?"  # Optional raid level. Not used for raid 1
-    r"(, (?P<chunk_size>\S+) chunk, algorithm (?P<algorithm>\d+) )?"  # Chunk and algorithm. raid 4/5/6 only (?)
-    r"\[(?P<expected_device_count>\d+)/(?P<current_device_count>\d+)\] "  # Current and expected device count
-    r"\[[U_]+\]$"  # Missing/present devices graphic
+    r"^(?P<block_count>\d+) blocks"  # total block count
+    r"( super (?P<superblock_format>\d+\.\d+|external:\S+))?"  # Optional superblock format
+    r"(.*? (?P<chunk_size>\d+[kK]) chunks?,?)?"  # Chunk size. Not present for raid 1 and linear
+    r".*?"  # Level specific data, like the raid level, algorithm or layout. Not used
+    r"( \[(?P<expected_device_count>\d+)/(?P<current_device_count>\d+)\]"  # Current and expected device count
+    r" \[(?P<device_map>[U_]+)\])?$"  # Missing/present devices graphic. Both are not present for raid 0 and linear
+)
+component_parser = re.compile(  # Parses a single component device in the header line, like "sdb4[1](F)"
+    r"^(?P<name>\S+)\[(?P<slot>\d+)\](?P<flags>(\([A-Z]\))*)$"
 )
 
 activity_parser = re.compile(  # Parses a currently running activity: recovery, resync and check
-    r"^\[=.*>\.*]\s+"  # Graphical progress indicator
-    r"(?P<activity_mode>\S+) = (?P<progress>([1-9]\d{1,2}|\d)\.\d)% "  # Activity and progress in percent
+    r"^\[=*>\.*]\s+"  # Graphical progress indicator
+    r"(?P<activity_mode>\S+) =\s*(?P<progress>([1-9]\d{1,2}|\d)\.\d)% "  # Activity and progress in percent
     r"\((?P<current_block>\d+)/(?P<total_blocks>\d+)\) "  # Currently processed block and total block count
     r"finish=(?P<eta_min>\d+\.\d)min"  # Fractional ETA in minutes
     r"( speed=(?P<speed>\d+)K/sec)?"  # Current speed in kbytes/second . Optional?
 )
 bitmap_parser = re.compile(  # Parses the bitmap usage, for arrays that have it enabled.
     r"^bitmap: (?P<used_pages_count>\d+)/(?P<total_pages_count>\d+) pages "
-    r"\[(?P<size_used_kb>\d)KB\], (?P<bitmap_chunk_size_kb>\d+)KB chunk"
+    r"\[(?P<size_used_kb>\d+)KB\], (?P<bitmap_chunk_size_kb>\d+)KB chunk"
 )
+# Cheap tests on the raw /proc/mdstat content, that do not require parsing any array
+degraded_device_map_finder = re.compile(r" \[[U_]*_[U_]*\]\s*$", re.MULTILINE)  # Like [U_], a missing component
+activity_finder = re.compile(r"^\s*\[=*>", re.MULTILINE)  # Progress bar of a recovery, resync or check
+
+# RAID levels that can survive the loss of a component and therefore can make use of hot spares.
+redundant_raid_levels = frozenset(("raid1", "raid4", "raid5", "raid6", "raid10"))
+# Number of components each RAID level can lose without losing data. raid1 can lose all but one component and is
+# handled separately. For raid10, the number of copies is not parsed, so the minimum of two copies is assumed.
+raid_level_redundancy = {
+    "raid4": 1,
+    "raid5": 1,
+    "raid6": 2,
+    "raid10": 1,
+}
+# /proc/mdstat reports sizes in blocks of 1 KiB
+BLOCK_SIZE = 1024
+
+
+def bit_count(bitset: int) -> int:
+    """Returns the number of set bits in the given non-negative integer."""
+    return bin(bitset).count("1")
 
 
 class RaidDeviceInfo:
-    """Groups information for a single MD device. Parses a single block from mdstat output."""
-    def __init__(self, line_1: str, line_2: str, line_3: str = None, line_4: str = None):
-        self.md_device, self.is_active, self.raid_level, self.component_devices = self._parse_header_line(line_1)
+    """
+    Groups information for a single MD device. Parses a single block from mdstat output.
+    Component states are stored as integer bitsets. Bit n of present_mask is set, if the n-th position in the
+    [UU_] map is up. In all other masks, bit n refers to the component with the slot number [n] in the header line.
+    In lazy mode, lines are not parsed on instantiation. Instead, a line is parsed when any field stored in it is
+    accessed for the first time. All fields of that line are then stored as regular instance attributes,
+    so that subsequent accesses do not parse again.
+    """
+    # Header line
+    md_device: str
+    is_active: bool
+    raid_level: str
+    component_devices: typing.List[str]
+    component_names: typing.List[str]
+    faulty_mask: int
+    spare_mask: int
+    write_mostly_mask: int
+    replacement_mask: int
+    # Block count line
+    block_count: int
+    superblock_format: typing.Optional[str]
+    chunk_size: typing.Optional[str]
+    expected_device_count: int
+    current_device_count: int
+    present_mask: int
+    # Optional activity line
+    current_activity: str
+    progress_percent: float
+    currently_processed_block: int
+    activity_eta_minutes: float
+    speed_kbytes_per_sec: int
+    # Optional bitmap line
+    has_bitmap: bool
+    bitmap_used_pages: int
+    bitmap_total_pages: int
+    bitmap_used_size_kb: int
+    bitmap_chunk_size_kb: int
+
+    def __init__(self, line_1: str, line_2: str, line_3: str = None, line_4: str = None, lazy: bool = False):
+        self._lines = (line_1, line_2, line_3, line_4)
+        if not lazy:
+            for parse_line_group in self._line_group_parsers:
+                parse_line_group(self)
+
+    def __getattr__(self, name: str):
+        # Only called for attributes that are not set yet. Parse the line containing the requested field.
+        try:
+            parse_line_group = self._field_line_group_parsers[name]
+        except KeyError:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'") from None
+        parse_line_group(self)
+        return self.__dict__[name]
+
+    def _parse_header_group(self):
+        self.md_device, self.is_active, self.raid_level, self.component_devices = \
+            self._parse_header_line(self._lines[0])
+        self.component_names, self.faulty_mask, self.spare_mask, self.write_mostly_mask, self.replacement_mask = \
+            self._parse_component_devices(self.component_devices)
+
+    def _parse_block_count_group(self):
         self.block_count, self.superblock_format, self.chunk_size, self.expected_device_count, \
-            self.current_device_count = self._parse_block_count_line(line_2)
-
-        # Set defaults for optional parts
-        self.current_activity = "idle"
-        self.progress_percent = 0.0
-        self.currently_processed_block = 0
-        self.activity_eta_minutes = 0.0
-        self.speed_kbytes_per_sec = 0
-
-        self.has_bitmap = False
-        self.bitmap_used_pages = 0
-        self.bitmap_total_pages = 0
-        self.bitmap_used_size_kb = 0
-        self.bitmap_chunk_size_kb = 0
-
-        if line_3:
-            if line_3.startswith("bitmap"):
-                # Device has a bitmap and is currently idle
-                self.has_bitmap = True
-                self.bitmap_used_pages, self.bitmap_total_pages, self.bitmap_used_size_kb, self.bitmap_chunk_size_kb = \
-                    self._parse_bitmap_line(line_3)
-            else:
-                # Device has no bitmap and a recovery, resync or check in progress
-                self.current_activity, self.progress_percent, self.currently_processed_block, \
-                    self.activity_eta_minutes, self.speed_kbytes_per_sec = self._parse_activity_line(line_3)
-        
+            self.current_device_count, self.present_mask = self._parse_block_count_line(self._lines[1])
+        if self.expected_device_count is None:
+            # Arrays without redundancy (raid 0, linear) do not report device counts. All components are required.
+            self.expected_device_count = self.current_device_count = self.component_count
+            self.present_mask = (1 << self.component_count) - 1
+
+    def _parse_activity_group(self):
+        line_3 = self._lines[2]
+        if line_3 and not line_3.startswith("bitmap"):
+            # Device has a recovery, resync or check in progress
+            self.current_activity, self.progress_percent, self.currently_processed_block, \
+                self.activity_eta_minutes, self.speed_kbytes_per_sec = self._parse_activity_line(line_3)
+        else:
+            self.current_activity = "idle"
+            self.progress_percent = 0.0
+            self.currently_processed_block = 0
+            self.activity_eta_minutes = 0.0
+            self.speed_kbytes_per_sec = 0
+
+    def _parse_bitmap_group(self):
+        line_3, line_4 = self._lines[2:]
         if line_4:
             # Device has a bitmap and a recovery, resync or check in progress
-            self.has_bitmap = True
+            bitmap_line = line_4
+        elif line_3 and line_3.startswith("bitmap"):
+            # Device has a bitmap and is currently idle
+            bitmap_line = line_3
+        else:
+            bitmap_line = None
+        self.has_bitmap = bitmap_line is not None
+        if self.has_bitmap:
             self.bitmap_used_pages, self.bitmap_total_pages, self.bitmap_used_size_kb, self.bitmap_chunk_size_kb = \
-                self._parse_bitmap_line(line_4)
+                self._parse_bitmap_line(bitmap_line)
+        else:
+            self.bitmap_used_pages = 0
+            self.bitmap_total_pages = 0
+            self.bitmap_used_size_kb = 0
+            self.bitmap_chunk_size_kb = 0
+
+    _line_group_parsers = (_parse_header_group, _parse_block_count_group, _parse_activity_group, _parse_bitmap_group)
+    _field_line_group_parsers = {
+        **dict.fromkeys(
+            ("md_device", "is_active", "raid_level", "component_devices", "component_names", "faulty_mask",
+             "spare_mask", "write_mostly_mask", "replacement_mask"),
+            _parse_header_group),
+        **dict.fromkeys(
+            ("block_count", "superblock_format", "chunk_size", "expected_device_count", "current_device_count",
+             "present_mask"),
+            _parse_block_count_group),
+        **dict.fromkeys(
+            ("current_activity", "progress_percent", "currently_processed_block", "activity_eta_minutes",
+             "speed_kbytes_per_sec"),
+            _parse_activity_group),
+        **dict.fromkeys(
+            ("has_bitmap", "bitmap_used_pages", "bitmap_total_pages", "bitmap_used_size_kb", "bitmap_chunk_size_kb"),
+            _parse_bitmap_group),
+    }
 
     @staticmethod
     def _parse_header_line(header_line: str):
@@ -89,6 +197,21 @@ class RaidDeviceInfo:
         raid_level = header_result.group("level")
         component_devices = header_result.group("components").strip().split(" ")
         return md_device, is_active, raid_level, component_devices
+
+    @staticmethod
+    def _parse_component_devices(component_devices: typing.List[str]):
+        component_names = []
+        # Faulty, spare, write-mostly and replacement
+        flag_masks = dict.fromkeys("FSWR", 0)
+        for component in component_devices:
+            component_result = component_parser.match(component)
+            component_names.append(component_result.group("name"))
+            slot_bit = 1 << int(component_result.group("slot"))
+            # The flags group looks like "(W)(R)", so every third character is a flag.
+            for flag in component_result.group("flags")[1::3]:
+                if flag in flag_masks:
+                    flag_masks[flag] |= slot_bit
+        return component_names, flag_masks["F"], flag_masks["S"], flag_masks["W"], flag_masks["R"]
     
     @staticmethod
     def _parse_block_count_line(block_count_line: str):
@@ -96,9 +219,15 @@ class RaidDeviceInfo:
         block_count = int(block_count_result.group("block_count"))
         superblock_format = block_count_result.group("superblock_format")
         chunk_size = block_count_result.group("chunk_size")
-        expected_device_count = int(block_count_result.group("expected_device_count"))
-        current_device_count = int(block_count_result.group("current_device_count"))
-        return block_count, superblock_format, chunk_size, expected_device_count, current_device_count
+        if block_count_result.group("expected_device_count") is None:
+            expected_device_count = current_device_count = present_mask = None
+        else:
+            expected_device_count = int(block_count_result.group("expected_device_count"))
+            current_device_count = int(block_count_result.group("current_device_count"))
+            present_mask = sum(
+                1 << position for position, state in enumerate(block_count_result.group("device_map")) if state == "U"
+            )
+        return block_count, superblock_format, chunk_size, expected_device_count, current_device_count, present_mask
 
     @staticmethod
     def _parse_activity_line(activity_line: str):
@@ -107,7 +236,7 @@ class RaidDeviceInfo:
         progress_percent = float(activity_result.group("progress"))
         currently_processed_block = int(activity_result.group("current_block"))
         activity_eta_minutes = float(activity_result.group("eta_min"))
-        speed_kbytes_per_sec = int(activity_result.group("speed"))
+        speed_kbytes_per_sec = int(activity_result.group("speed") or 0)
         return current_activity, progress_percent, currently_processed_block, activity_eta_minutes, speed_kbytes_per_sec
 
     @staticmethod
@@ -123,22 +252,35 @@ class RaidDeviceInfo:
     def component_count(self) -> int:
         return len(self.component_devices)
 
+    @property
+    def redundancy(self) -> int:
+        """Number of components the array can lose without losing data, when all components are present."""
+        if self.raid_level == "raid1":
+            return self.expected_device_count - 1
+        return raid_level_redundancy.get(self.raid_level, 0)
+
+
+def read_proc_mdstat() -> str:
+    """Returns the current content of /proc/mdstat."""
+    if not proc_mdstat_path.exists():
+        raise RuntimeError(f"Can’t access {proc_mdstat_path}. File does not exist.")
+    return proc_mdstat_path.read_text(encoding="ascii")
+
 
 class RaidStatus:
-    """Parses the current RAID status by parsing /proc/mdstat output"""
-    def __init__(self, mdstat: str = None):
+    """
+    Parses the current RAID status by parsing /proc/mdstat output.
+    In lazy mode, the output is only split into per-device blocks. See RaidDeviceInfo.
+    """
+    def __init__(self, mdstat: str = None, lazy: bool = False):
         if mdstat is None:
-            mdstat = self._read_status_from_proc()
-        self.device_info = list(self._parse_device_info(mdstat))
-
-    @staticmethod
-    def _read_status_from_proc() -> str:
-        if not proc_mdstat_path.exists():
-            raise RuntimeError(f"Can’t access {proc_mdstat_path}. File does not exist.")
-        return proc_mdstat_path.read_text(encoding="ascii")
+            mdstat = read_proc_mdstat()
+        self.mdstat = mdstat
+        self.device_info = list(self._parse_device_info(mdstat, lazy))
+        self._capacity_totals: typing.Optional[typing.Tuple[int, int, int, int]] = None
 
     @staticmethod
-    def _parse_device_info(mdstat: str):
+    def _parse_device_info(mdstat: str, lazy: bool):
         block_lines = []
         for line in mdstat.splitlines(keepends=False):
             line = line.strip()  # Some empty lines actually contain whitespace characters.
@@ -146,8 +288,8 @@ class RaidStatus:
                 continue
             if line:
                 block_lines.append(line)
-            else:
-                yield RaidDeviceInfo(*block_lines)
+            elif block_lines:
+                yield RaidDeviceInfo(*block_lines, lazy=lazy)
                 block_lines.clear()
 
     @staticmethod
@@ -160,6 +302,13 @@ class RaidStatus:
         ]
         return any(line.startswith(ignored) for ignored in ignored_lines)
 
+    def has_degraded_or_busy_devices(self) -> bool:
+        """
+        Returns True, if any array is degraded or performs maintenance. Tests the raw content instead of the parsed
+        arrays, so that it does not defeat lazy parsing.
+        """
+        return bool(degraded_device_map_finder.search(self.mdstat) or activity_finder.search(self.mdstat))
+
     @property
     def total_device_count(self) -> int:
         return len(self.device_info)
@@ -192,6 +341,27 @@ class RaidStatus:
     def total_bitmap_page_count(self) -> int:
         return sum(device.bitmap_total_pages for device in self.device_info)
 
+    @property
+    def failed_component_count(self) -> int:
+        return sum(bit_count(device.faulty_mask) for device in self.device_info)
+
+    @property
+    def spare_component_count(self) -> int:
+        # A failed spare can not replace anything.
+        return sum(bit_count(device.spare_mask & ~device.faulty_mask) for device in self.device_info)
+
+    @property
+    def write_mostly_component_count(self) -> int:
+        return sum(bit_count(device.write_mostly_mask) for device in self.device_info)
+
+    @property
+    def without_spare_device_count(self) -> int:
+        """Number of arrays with redundancy, that have no working hot spare available."""
+        return sum(
+            1 for device in self.device_info
+            if device.raid_level in redundant_raid_levels and not device.spare_mask & ~device.faulty_mask
+        )
+
     @property
     def in_maintenance_device_count(self):
         return sum(device.current_activity != "idle" for device in self.device_info)
@@ -207,3 +377,42 @@ class RaidStatus:
     @property
     def in_recovery_device_count(self):
         return sum(device.current_activity == "recovery" for device in self.device_info)
+
+    def _get_capacity_totals(self) -> typing.Tuple[int, int, int, int]:
+        """
+        Returns the total capacity, the capacity of degraded arrays, the capacity of arrays under resync or recovery
+        and the capacity of arrays without redundancy left, all in bytes. These are computed in a single pass on first
+        access, as a snapshot never changes.
+        """
+        if self._capacity_totals is None:
+            total = degraded = rebuilding = without_redundancy = 0
+            for device in self.device_info:
+                capacity = device.block_count * BLOCK_SIZE
+                missing_device_count = device.expected_device_count - device.current_device_count
+                total += capacity
+                if missing_device_count > 0:
+                    degraded += capacity
+                if device.current_activity in ("resync", "recovery"):
+                    rebuilding += capacity
+                if missing_device_count >= device.redundancy:
+                    without_redundancy += capacity
+            self._capacity_totals = total, degraded, rebuilding, without_redundancy
+        return self._capacity_totals
+
+    @property
+    def total_capacity_bytes(self) -> int:
+        return self._get_capacity_totals()[0]
+
+    @property
+    def degraded_capacity_bytes(self) -> int:
+        return self._get_capacity_totals()[1]
+
+    @property
+    def rebuilding_capacity_bytes(self) -> int:
+        """Capacity of arrays under resync or recovery."""
+        return self._get_capacity_totals()[2]
+
+    @property
+    def without_redundancy_capacity_bytes(self) -> int:
+        """Capacity of arrays that lost as many components as they can tolerate, or never had redundancy."""
+        return self._get_capacity_totals()[3]
@@ -0,0 +1,145 @@
+# Copyright (C) 2020 Thomas Hess <thomas.hess@udo.edu>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Records /proc/mdstat snapshots to a file and replays them later.
+
+A recording is a text file with one JSON object per line: {"time": <unix timestamp>, "mdstat": <content>}.
+Only snapshots that differ from the previously recorded one are written, so an idle system produces (almost)
+no output. If the file name ends with ".gz", the recording is transparently gzip compressed.
+Records are flushed as they are written. If the recorder is killed, the recording ends with a truncated record or an
+unterminated gzip stream. Replaying such a recording keeps all complete records and drops the truncated one.
+Before appending to such a recording, the recorder cuts it back to the last complete record.
+"""
+
+import bisect
+import gzip
+import io
+import json
+from pathlib import Path
+import time
+import typing
+
+
+def _open_recording(path: Path, mode: str) -> typing.TextIO:
+    if path.suffix == ".gz":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return path.open(mode, encoding="utf-8")
+
+
+def _read_lines(path: Path) -> typing.Tuple[typing.List[str], bool]:
+    """
+    Returns all lines of the recording and whether the gzip stream was terminated. Plain recordings are always
+    terminated. The last line may be incomplete, if the recorder was killed.
+    """
+    lines = []
+    with _open_recording(path, "r") as recording:
+        try:
+            for line in recording:
+                lines.append(line)
+        except EOFError:
+            # The gzip stream was not terminated, because the recorder was killed. Keep everything read so far.
+            return lines, False
+    return lines, True
+
+
+def _repair_recording(path: Path):
+    """
+    Cuts a recording left by a killed recorder back to its last complete record, so that appended records stay
+    readable. A gzip recording without stream end is rewritten, as a new stream can not follow an unterminated one.
+    """
+    if not path.exists() or not path.stat().st_size:
+        return
+    if path.suffix == ".gz":
+        lines, terminated = _read_lines(path)
+        if terminated:
+            return
+        if lines and not lines[-1].endswith("\n"):
+            del lines[-1]
+        with _open_recording(path, "w") as recording:
+            recording.writelines(lines)
+        return
+    with path.open("rb+") as recording:
+        recording.seek(-1, io.SEEK_END)
+        if recording.read(1) == b"\n":
+            return
+        recording.seek(0)
+        content = recording.read()
+        recording.truncate(content.rfind(b"\n") + 1)
+
+
+class MdstatRecorder:
+    """Appends timestamped mdstat snapshots to a recording file, skipping unchanged snapshots."""
+    def __init__(self, path: Path, clock: typing.Callable[[], float] = time.time):
+        self.path = path
+        self.clock = clock
+        self.last_mdstat: typing.Optional[str] = None
+        _repair_recording(path)
+        self._file = _open_recording(path, "a")
+
+    def record(self, mdstat: str):
+        if mdstat == self.last_mdstat:
+            return
+        self.last_mdstat = mdstat
+        self._file.write(json.dumps({"time": self.clock(), "mdstat": mdstat}) + "\n")
+        # Flush each record, so that a capture survives a crash of the monitor. MdstatReplay drops a truncated record.
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class MdstatReplay:
+    """
+    Replays a recording created by MdstatRecorder. Use read() as the mdstat source.
+    The recording is played back relative to the moment of instantiation. The speed factor scales the time,
+    so a recording covering 12 hours replays in 12 seconds with a speed factor of 3600.
+    After the last snapshot is reached, the last snapshot is returned indefinitely.
+    """
+    def __init__(self, path: Path, speed: float = 1.0, clock: typing.Callable[[], float] = time.monotonic):
+        if speed <= 0:
+            raise ValueError(f"Invalid replay speed. Expected a positive number. Got {speed}.")
+        self.speed = speed
+        self.clock = clock
+        self.timestamps, self.snapshots = self._load(path)
+        if not self.snapshots:
+            raise ValueError(f"Recording {path} does not contain any mdstat snapshot.")
+        self.start_time = clock()
+
+    @staticmethod
+    def _load(path: Path) -> typing.Tuple[typing.List[float], typing.List[str]]:
+        timestamps = []
+        snapshots = []
+        lines = [line for line in _read_lines(path)[0] if line.strip()]
+        for line_number, line in enumerate(lines, start=1):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                if line_number == len(lines):
+                    # The last record was only partially written before the recorder was killed.
+                    break
+                raise
+            timestamps.append(float(record["time"]))
+            snapshots.append(record["mdstat"])
+        return timestamps, snapshots
+
+    @property
+    def current_index(self) -> int:
+        recorded_time = self.timestamps[0] + (self.clock() - self.start_time) * self.speed
+        # Never go below the first snapshot, even if the clock is adjusted.
+        return max(0, bisect.bisect_right(self.timestamps, recorded_time) - 1)
+
+    def read(self) -> str:
+        return self.snapshots[self.current_index]
@@ -0,0 +1,44 @@
+# Copyright (C) 2020 Thomas Hess <thomas.hess@udo.edu>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from ksysguard_mdraid_monitor.model import RaidStatus
+
+
+class AdaptiveRefreshScheduler:
+    """
+    Chooses the delay between two reads of /proc/mdstat based on the current RAID status.
+    While any array is degraded or performs maintenance, the minimal interval is used to provide near-real-time values.
+    Otherwise, the interval is doubled each time the content did not change, up to the maximal interval.
+    Any change in an idle, clean system resets the interval to the minimum.
+    """
+    def __init__(self, min_interval_ms: int, max_interval_ms: int):
+        if max_interval_ms < min_interval_ms:
+            raise ValueError(
+                f"Maximal interval ({max_interval_ms} ms) is smaller than the minimal interval ({min_interval_ms} ms).")
+        self.min_interval_ms = min_interval_ms
+        self.max_interval_ms = max_interval_ms
+        self.interval_ms = min_interval_ms
+
+    @property
+    def interval_ns(self) -> int:
+        return self.interval_ms * 1_000_000
+
+    def update(self, raid_status: RaidStatus, content_changed: bool):
+        """Computes the interval until the next read, after a read of /proc/mdstat."""
+        if content_changed or raid_status.has_degraded_or_busy_devices():
+            self.interval_ms = self.min_interval_ms
+        else:
+            # Exponential back-off. max() ensures that a minimal interval of zero can grow.
+            self.interval_ms = min(max(2 * self.interval_ms, 1), self.max_interval_ms)
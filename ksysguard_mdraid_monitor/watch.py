@@ -0,0 +1,73 @@
+# Copyright (C) 2020 Thomas Hess <thomas.hess@udo.edu>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import typing
+
+
+class Subscription:
+    """A set of sensors pushed to the client in a fixed interval, created by the "watch" command."""
+    def __init__(self, sensor_names: typing.List[str], interval_ms: int, only_changes: bool, now_ns: int):
+        self.sensor_names = sensor_names
+        self.interval_ns = interval_ms * 1_000_000
+        self.only_changes = only_changes
+        self.next_push_ns = now_ns
+        self.last_values: typing.Dict[str, str] = {}
+
+    def render(self, values: typing.Dict[str, str]) -> typing.List[str]:
+        """
+        Returns the output lines for a push, given the current values of all watched sensors.
+        If only changes are pushed, unchanged sensors are omitted.
+        """
+        lines = []
+        for sensor_name in self.sensor_names:
+            value = values[sensor_name]
+            if not self.only_changes or self.last_values.get(sensor_name) != value:
+                lines.append(f"{sensor_name}\t{value}")
+            self.last_values[sensor_name] = value
+        return lines
+
+    def schedule_next_push(self, now_ns: int):
+        self.next_push_ns += self.interval_ns
+        if self.next_push_ns <= now_ns:
+            # The push is late. Do not try to catch up with missed pushes.
+            self.next_push_ns = now_ns + self.interval_ns
+
+
+class WatchManager:
+    """Keeps track of all subscriptions and determines, which are due for a push."""
+    def __init__(self):
+        self.subscriptions: typing.List[Subscription] = []
+
+    def add(self, sensor_names: typing.List[str], interval_ms: int, only_changes: bool):
+        self.subscriptions.append(Subscription(sensor_names, interval_ms, only_changes, time.monotonic_ns()))
+
+    def clear(self):
+        self.subscriptions.clear()
+
+    def seconds_until_next_push(self) -> typing.Optional[float]:
+        """Returns the time until the next push is due, or None, if nothing is watched."""
+        if not self.subscriptions:
+            return None
+        next_push_ns = min(subscription.next_push_ns for subscription in self.subscriptions)
+        return max(0, next_push_ns - time.monotonic_ns()) / 1_000_000_000
+
+    def due_subscriptions(self) -> typing.List[Subscription]:
+        """Returns all subscriptions that are due for a push and schedules their next push."""
+        now = time.monotonic_ns()
+        due = [subscription for subscription in self.subscriptions if subscription.next_push_ns <= now]
+        for subscription in due:
+            subscription.schedule_next_push(now)
+        return due
@@ -0,0 +1,172 @@
+# Copyright (C) 2020 Thomas Hess <thomas.hess@udo.edu>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Statistics of sensor values over sliding time windows, with a fixed memory footprint per sensor."""
+
+from array import array
+import math
+import typing
+
+BUCKETS_PER_WINDOW = 60
+# Window name, as used in queries, and its duration in seconds
+WINDOWS = {
+    "1m": 60,
+    "5m": 5 * 60,
+    "15m": 15 * 60,
+    "1h": 60 * 60,
+}
+STATISTICS = ("min", "max", "avg", "last")
+# Time slice number of buckets that were never used. Lies before any window
+UNUSED_SLICE = -2**63
+
+
+class BucketRing:
+    """
+    Divides a time window into a fixed number of buckets. Each bucket aggregates minimum, maximum and count of the
+    values present during its time slice and the time-weighted sum of the values held during it. Buckets are reused
+    in a ring, so that a bucket is reset when its time slice is reached again after a full revolution. The window
+    usually starts within a time slice, so the ring holds one bucket more than the window covers and the oldest one is
+    weighted by the part of it still inside the window.
+    """
+    def __init__(self, window_duration_ns: int, bucket_count: int = BUCKETS_PER_WINDOW):
+        self.window_duration_ns = window_duration_ns
+        self.bucket_duration_ns = window_duration_ns // bucket_count
+        bucket_count += 1
+        self.bucket_count = bucket_count
+        # Absolute number of the time slice currently stored in each bucket
+        self.slices = array("q", [UNUSED_SLICE] * bucket_count)
+        self.minimums = array("d", [0.0] * bucket_count)
+        self.maximums = array("d", [0.0] * bucket_count)
+        self.counts = array("q", [0] * bucket_count)
+        # Sum of value × held duration in seconds, and the sum of the held durations
+        self.weighted_sums = array("d", [0.0] * bucket_count)
+        self.durations = array("d", [0.0] * bucket_count)
+
+    def _get_bucket(self, time_slice: int) -> int:
+        """Returns the index of the bucket for the given time slice, resetting it, if it holds an older time slice."""
+        index = time_slice % self.bucket_count
+        if self.slices[index] != time_slice:
+            self.slices[index] = time_slice
+            self.minimums[index] = math.inf
+            self.maximums[index] = -math.inf
+            self.counts[index] = 0
+            self.weighted_sums[index] = self.durations[index] = 0.0
+        return index
+
+    def _add_to_bucket(self, index: int, value: float):
+        self.minimums[index] = min(self.minimums[index], value)
+        self.maximums[index] = max(self.maximums[index], value)
+        self.counts[index] += 1
+
+    def add(self, value: float, now_ns: int):
+        """Adds a value that became current at the given time."""
+        self._add_to_bucket(self._get_bucket(now_ns // self.bucket_duration_ns), value)
+
+    def add_held_interval(self, value: float, start_ns: int, end_ns: int):
+        """
+        Accounts for a value held from start to end. The interval is split across the time slices it covers. The part
+        before the window ending at end is dropped. The value is present in each covered slice for min and max, too.
+        """
+        start_ns = max(start_ns, end_ns - self.window_duration_ns)
+        time_slice = start_ns // self.bucket_duration_ns
+        while start_ns < end_ns:
+            slice_end_ns = min(end_ns, (time_slice + 1) * self.bucket_duration_ns)
+            index = self._get_bucket(time_slice)
+            self._add_to_bucket(index, value)
+            held_s = (slice_end_ns - start_ns) / 1_000_000_000
+            self.weighted_sums[index] += value * held_s
+            self.durations[index] += held_s
+            start_ns = slice_end_ns
+            time_slice += 1
+
+    def statistics(self, now_ns: int) -> typing.Optional[typing.Tuple[float, float, typing.Optional[float]]]:
+        """
+        Returns minimum, maximum and time-weighted average of all values in the window, or None, if there are none.
+        The average is None, if no value was held for any time yet.
+        """
+        window_start_ns = now_ns - self.window_duration_ns
+        oldest_slice = window_start_ns // self.bucket_duration_ns
+        # Part of the oldest time slice that is still inside the window
+        oldest_fraction = ((oldest_slice + 1) * self.bucket_duration_ns - window_start_ns) / self.bucket_duration_ns
+        minimum = math.inf
+        maximum = -math.inf
+        weighted_sum = 0.0
+        duration = 0.0
+        count = 0
+        for index, time_slice in enumerate(self.slices):
+            if time_slice >= oldest_slice:
+                minimum = min(minimum, self.minimums[index])
+                maximum = max(maximum, self.maximums[index])
+                fraction = oldest_fraction if time_slice == oldest_slice else 1.0
+                weighted_sum += self.weighted_sums[index] * fraction
+                duration += self.durations[index] * fraction
+                count += self.counts[index]
+        if not count:
+            return None
+        return minimum, maximum, weighted_sum / duration if duration else None
+
+
+class SensorWindows:
+    """
+    Tracks the values of a single sensor over all windows defined in WINDOWS. The average weights each value by the
+    time it was held, so that periods with frequent changes do not dominate it. A value is considered held until the
+    next value is added, so sparse samples still cover the whole time.
+    """
+    def __init__(self):
+        self.rings = {name: BucketRing(duration * 1_000_000_000) for name, duration in WINDOWS.items()}
+        self.last_value: typing.Optional[float] = None
+        self.last_value_ns = 0
+
+    def _account_held_value(self, now_ns: int):
+        """Accounts for the last value, held until now."""
+        if self.last_value is not None and now_ns > self.last_value_ns:
+            for ring in self.rings.values():
+                ring.add_held_interval(self.last_value, self.last_value_ns, now_ns)
+            self.last_value_ns = now_ns
+
+    def add(self, value: float, now_ns: int):
+        """Adds the current value. Call this, whenever the value may have changed."""
+        self._account_held_value(now_ns)
+        for ring in self.rings.values():
+            ring.add(value, now_ns)
+        self.last_value = value
+        self.last_value_ns = now_ns
+
+    def query(self, window: str, statistic: str, now_ns: int) -> typing.Optional[float]:
+        """
+        Returns the requested statistic over the given window, including the last value held until now.
+        Returns None, if no value was added at all.
+        """
+        if statistic == "last":
+            return self.last_value
+        self._account_held_value(now_ns)
+        statistics = self.rings[window].statistics(now_ns)
+        if statistics is None:
+            return self.last_value
+        value = statistics[STATISTICS.index(statistic)]
+        return self.last_value if value is None else value
+
+
+def parse_windowed_query(query: str) -> typing.Optional[typing.Tuple[str, str, str]]:
+    """
+    Splits a query like "SoftRaid/DegradedDevices@5m:max" into sensor name, window and statistic.
+    The statistic is optional and defaults to "avg". Returns None, if the query is malformed.
+    """
+    sensor_name, _, window = query.rpartition("@")
+    window, _, statistic = window.partition(":")
+    statistic = statistic or "avg"
+    if not sensor_name or window not in WINDOWS or statistic not in STATISTICS:
+        return None
+    return sensor_name, window, statistic